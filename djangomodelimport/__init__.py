@@ -1,10 +1,41 @@
+from .caches import SharedLookupCache  # noqa
+from .checkpoints import Checkpoint, CheckpointStore, FileCheckpointStore  # noqa
 from .core import ModelImporter  # noqa
+from .fields import (  # noqa
+    CachedChoiceField,
+    DateTimeParserField,
+    FlatRelatedField,
+    JSONField,
+    PreloadedChoiceField,
+    SourceFieldSwitcher,
+)
 from .forms import ImporterModelForm  # noqa
 from .parsers import (
     BaseImportParser,
+    CSVImportParser,
     TablibCSVImportParser,
     TablibXLSXImportParser,
+    XLSXImportParser,
 )  # noqa
-from .resultset import ImportResultRow, ImportResultSet  # noqa
+from .profiling import ImportProfiler  # noqa
+from .resultset import (  # noqa
+    ImportResultRow,
+    ImportResultSet,
+    SQLiteImportResultSet,
+    StreamingImportResultSet,
+)
+from .transactions import (  # noqa
+    ChunkSavepointStrategy,
+    NoSavepointStrategy,
+    RowSavepointStrategy,
+    SingleTransactionStrategy,
+    TransactionStrategy,
+)
+from .widgets import (  # noqa
+    CompositeLookupWidget,
+    DisplayChoiceWidget,
+    JSONFieldWidget,
+    NamedSourceWidget,
+)
 
 __version__ = "0.7.5"
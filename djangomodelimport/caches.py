@@ -1,6 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
 class SimpleDictCache(dict):
     """A simple cache object keyed by the field name, containing a number of
     cached instance loaders or preloaded caches.
     """
 
-    pass
+    def __init__(self, shared=None):
+        """
+        @param shared A SharedLookupCache to take the loaders from, so they're reused by later imports.
+        """
+        super().__init__()
+        self.shared = shared
+
+
+class SharedLookupCache:
+    """Lookup caches which are kept between imports, e.g. for a preview and the commit that follows it,
+    or back to back imports for the same tenant. Pass it to `ModelImporter.process` as `lookup_cache`.
+
+    The loaders are keyed by the lookups they make (the model, `to_field` and query of the field's
+    queryset), rather than the field name, so any importer with the same lookups can share them.
+    The least recently used loaders are evicted once they hold more than `max_entries` values
+    between them, or there are more than `max_loaders` of them.
+
+    Cached lookups go stale if the rows they looked up change. The loaders for the model being
+    imported are dropped after each committed import, and the values which weren't found are dropped
+    after every import; call `invalidate` after changing any others.
+    """
+
+    def __init__(self, max_loaders=64, max_entries=100000):
+        self.max_loaders = max_loaders
+        self.max_entries = max_entries
+        self.loaders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_loader(self, fieldinstance):
+        """Return the loader for the field's lookups, creating it if need be."""
+        key = fieldinstance.get_loader_key()
+        with self._lock:
+            loader = self.loaders.get(key)
+            if loader is None:
+                loader = self.loaders[key] = fieldinstance.get_loader()
+            self.loaders.move_to_end(key)
+        self.trim()
+        return loader
+
+    def invalidate(self, model=None):
+        """Drop the loaders which look up the given model, or every loader."""
+        with self._lock:
+            for key, loader in list(self.loaders.items()):
+                if model is None or loader.model is model:
+                    del self.loaders[key]
+
+    def discard_errors(self):
+        """Forget the values which each loader couldn't find, which later imports may find."""
+        with self._lock:
+            for loader in self.loaders.values():
+                loader.discard_errors()
+
+    def trim(self):
+        """Evict the least recently used loaders until the cache is within its limits.
+
+        The most recently used loader is always kept, however big it is.
+        """
+        with self._lock:
+            entries = sum(len(loader) for loader in self.loaders.values())
+            while len(self.loaders) > 1 and (
+                len(self.loaders) > self.max_loaders or entries > self.max_entries
+            ):
+                _, loader = self.loaders.popitem(last=False)
+                entries -= len(loader)
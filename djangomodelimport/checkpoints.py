@@ -0,0 +1,99 @@
+import json
+import os
+
+""" Checkpoints let a long import commit a batch at a time, and pick up where it left off if it's interrupted.
+
+Each batch is recorded in two steps: `begin` is called inside the batch's transaction once its rows have been
+saved, and `commit` once the transaction has been committed. If the import dies in between, the ids of the rows
+the batch created are used to tell whether it was committed. """
+
+
+class Checkpoint:
+    """How far a checkpointed import has got."""
+
+    def __init__(self, line=0, counts=None, created_ids=None):
+        """
+        @param line The last line which has been committed.
+        @param counts The created, updated, skipped and failed counts up to that line.
+        @param created_ids The primary keys (as strings) of the rows created up to that line.
+        """
+        self.line = line
+        self.counts = counts or {}
+        self.created_ids = created_ids or []
+
+    def apply(self, line, counts, created_ids):
+        self.line = line
+        self.counts = counts
+        self.created_ids.extend(created_ids)
+
+
+class CheckpointStore:
+    def load(self, is_committed):
+        """Return the latest Checkpoint (an empty one if the import hasn't started).
+
+        @param is_committed A callable which is passed the created ids of a batch that was begun but
+            not committed, and returns whether the batch was committed to the database after all.
+        """
+        raise NotImplementedError
+
+    def begin(self, line, counts, created_ids):
+        """Record a batch which is about to be committed."""
+        raise NotImplementedError
+
+    def commit(self, line):
+        """Record that the batch up to `line` has been committed."""
+        raise NotImplementedError
+
+
+class FileCheckpointStore(CheckpointStore):
+    """Keeps checkpoints in an append-only JSON lines file, so each batch only writes its own created ids."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, is_committed):
+        checkpoint = Checkpoint()
+        if not os.path.exists(self.path):
+            return checkpoint
+
+        pending = None
+        with open(self.path, "r+b") as fh:
+            offset = 0
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    # The last record was cut short, drop it so the next one starts on a fresh line.
+                    fh.truncate(offset)
+                    break
+                record = json.loads(line)
+                offset += len(line)
+                if record["status"] == "pending":
+                    pending = record
+                elif pending and record["line"] == pending["line"]:
+                    checkpoint.apply(
+                        pending["line"], pending["counts"], pending["created_ids"]
+                    )
+                    pending = None
+
+        if pending and pending["created_ids"] and is_committed(pending["created_ids"]):
+            checkpoint.apply(pending["line"], pending["counts"], pending["created_ids"])
+            self.commit(pending["line"])
+        return checkpoint
+
+    def begin(self, line, counts, created_ids):
+        self._append(
+            {
+                "status": "pending",
+                "line": line,
+                "counts": counts,
+                "created_ids": created_ids,
+            }
+        )
+
+    def commit(self, line):
+        self._append({"status": "committed", "line": line})
+
+    def _append(self, record):
+        with open(self.path, "a") as fh:
+            fh.write(json.dumps(record) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
@@ -1,8 +1,60 @@
-from django.db import transaction
+import asyncio
+import os
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.transaction import TransactionManagementError
+
+from . import parallel
 from .caches import SimpleDictCache
 from .formclassbuilder import FormClassBuilder
+from .loaders import CachedInstanceLoader
+from .plan import ImportRowPlan
+from .profiling import NullProfiler
 from .resultset import ImportResultSet
+from .transactions import ChunkSavepointStrategy, RowSavepointStrategy
+from .uniqueness import UniquenessIndex
+from .utils import chunked, create_instances, iter_async
+
+
+class PendingRow:
+    """A processed row which is yet to be saved and added to the ImportResultSet."""
+
+    def __init__(
+        self,
+        linenumber,
+        row,
+        to_be_created,
+        errors=None,
+        instance=None,
+        form=None,
+        data=None,
+    ):
+        self.linenumber = linenumber
+        self.row = row
+        # The row as it's passed to the form, which may have had some of its columns parsed already.
+        self.data = row if data is None else data
+        self.to_be_created = to_be_created
+        self.errors = errors or []
+        self.warnings = []
+        self.instance = instance
+        self.form = form
+        # Rows rejected before validation (insert/update not permitted) are reported, but not counted.
+        self.counted = True
+        # The lines this row was rejected as a duplicate of, and the unique values it was checked with.
+        self.duplicates = set()
+        self.unique_keys = []
+
+    def fail(self, err):
+        """Record an error raised while saving this row."""
+        self.errors = [(self.linenumber, repr(err))]
 
 
 class ModelImporter:
@@ -17,16 +69,59 @@ class ModelImporter:
         self.modelimportformclass = modelimportformclass
         self.model = modelimportformclass.Meta.model
         self.update_cache = None
+        self.update_missing = None
         self.update_queryset = None
+        self.update_limited = False
+        # The UniquenessIndex of the last import, if the model has any unique fields to check.
+        self.unique_index = None
 
     def get_for_update(self, pk):
-        return (
-            self.update_cache[pk]
-            if self.update_cache
-            else self.update_queryset.get(pk=pk)
-        )
+        """Return the instance to be updated for a row.
+
+        Raises KeyError if the instance exists but isn't in the `limit_to_queryset`.
+        """
+        try:
+            # Normalise the id as `prefetch_for_update` does, so e.g. " 1" and "01" find the same instance.
+            key = str(self.model._meta.pk.to_python(pk))
+        except ValidationError:
+            # Let the query report the invalid id
+            return self.update_queryset.get(pk=pk)
+        if key in self.update_cache:
+            return self.update_cache[key]
+        if self.update_limited:
+            raise KeyError(pk)
+        if key in self.update_missing:
+            raise self.model.DoesNotExist(
+                "%s matching query does not exist." % self.model._meta.object_name
+            )
+        return self.update_queryset.get(pk=pk)
+
+    def prefetch_for_update(self, pks, chunk_size=500, select_related=()):
+        """Load the instances to be updated by a batch of rows, with a query per chunk of ids.
+
+        @param select_related Any relations to load along with the instances (e.g. for FlatRelatedFields).
+        """
+        pk_field = self.model._meta.pk
+        self.update_cache = {}
+
+        valid_pks = {}
+        for pk in pks:
+            try:
+                value = pk_field.to_python(pk)
+            except ValidationError:
+                pass  # Leave get_for_update to report the invalid id
+            else:
+                valid_pks[str(value)] = value
+
+        for chunk in chunked(valid_pks.values(), chunk_size):
+            queryset = self.update_queryset.filter(pk__in=chunk)
+            if select_related:
+                queryset = queryset.select_related(*select_related)
+            for obj in queryset.iterator(chunk_size=chunk_size):
+                self.update_cache[str(obj.pk)] = obj
+
+        self.update_missing = valid_pks.keys() - self.update_cache.keys()
 
-    @transaction.atomic
     def process(
         self,
         headers,
@@ -39,29 +134,64 @@ class ModelImporter:
         progress_logger=None,
         skip_func=None,
         resultset_cls=ImportResultSet,
+        bulk=False,
+        batch_size=500,
+        transaction_strategy=None,
+        caches=None,
+        start_line=1,
+        profiler=None,
+        checkpoint_store=None,
+        preparse=True,
+        lookup_cache=None,
     ):
         """Process the data.
 
-        @param limit_to_queryset A queryset which limits the instances which can be updated, and creates a cache of the
-            updatable records to improve update performance.
+        @param rows Any iterable of row dicts. Rows are read a batch at a time, so a generator (e.g. from the
+            CSVImportParser) is never fully loaded into memory.
+        @param limit_to_queryset A queryset which limits the instances which can be updated. The instances to
+            update are loaded in bulk for each batch of rows, from this queryset or the model's default manager.
+        @param progress_logger A callable which is passed each ImportResultRow as it is added to the results.
+        @param resultset_cls The ImportResultSet class to collect results in. Use StreamingImportResultSet along
+            with a `progress_logger` to consume results as they are produced, rather than holding on to them.
+        @param bulk Validate each row as usual, but buffer the valid instances and write them in batches of
+            `batch_size` using bulk_create / bulk_update. If a batch fails to write, it is split up and retried so
+            errors are still reported against the row that caused them. Only applies when `commit` is True.
+            Note that bulk writes bypass Model.save() and the pre_save / post_save signals.
+        @param batch_size The number of rows read at a time. Lookups for any cached fields are resolved in bulk
+            for each batch, and in bulk mode each batch is written together.
+        @param transaction_strategy A TransactionStrategy deciding how saves are wrapped in savepoints. Defaults to
+            a savepoint per row (ChunkSavepointStrategy in bulk mode). SingleTransactionStrategy fails fast without
+            any savepoints, and NoSavepointStrategy can be used to skip savepoints for previews.
+        @param caches A SimpleDictCache of lookups to reuse from a previous call with the same importer.
+        @param start_line The line number of the first row, when processing part of a file.
+        @param profiler An ImportProfiler to record the time spent, and queries run, in each phase of the import.
+            The stats are available from `importresult.get_profile()`.
+        @param checkpoint_store A CheckpointStore, to commit each batch in its own transaction (rather than the
+            whole import in one) and record a checkpoint after it. If the import is interrupted, processing the
+            same file with the same store skips the lines which were committed. Only the counts (not the results)
+            of those lines are included in the ImportResultSet. Requires `commit=True`.
+        @param preparse Parse the date columns of each batch a column at a time, with a format inferred from the
+            column, before validating the rows. Values which don't match the format are parsed by the form as usual.
+        @param lookup_cache A SharedLookupCache to take the cached lookups from, and keep them in for later calls
+            (e.g. the commit which follows a preview). Unlike `caches`, it can be shared by different importers.
         """
         # Set up a cache context which will be filled by the Cached fields
-        caches = SimpleDictCache()
+        if caches is None:
+            caches = SimpleDictCache(shared=lookup_cache)
 
-        # Set up an "update" cache to preload any objects which might be updated
+        if profiler is None:
+            profiler = NullProfiler()
+        profiler.importer = self.modelimportformclass.__name__
+        profiler.start_caches(caches)
+
+        # Set up the queryset for any objects which might be updated. The objects are loaded a batch at a time.
         if allow_update:
             self.update_queryset = (
                 limit_to_queryset
                 if limit_to_queryset is not None
                 else self.model.objects.all()
             )
-            # We only build the update_cache if limit_to_queryset is provided, with the assumption that the dataset
-            # is then not too big. This may not be a valid assumption.
-            # @todo Could we be smarter about the update cache, e.g. iterate through the source row PKs
-            self.update_cache = {}
-            if limit_to_queryset is not None:
-                for obj in self.update_queryset:
-                    self.update_cache[str(obj.id)] = obj
+            self.update_limited = limit_to_queryset is not None
 
         formclassbuilder = FormClassBuilder(self.modelimportformclass, headers)
 
@@ -71,114 +201,619 @@ class ModelImporter:
         # Create a Form for rows where doing an INSERT (includes required fields).
         ModelCreateForm = formclassbuilder.build_create_form()
 
+        # Work out what the forms need to know about their fields once, rather than for every row.
+        plans = {
+            form_class: ImportRowPlan.for_form_class(form_class, caches, headers)
+            for form_class in (ModelCreateForm, ModelUpdateForm)
+        }
+        # Check the unique fields of the rows against each other, and the database a batch at a time.
+        self.unique_index = unique_index = UniquenessIndex.for_model(self.model)
+        for plan in plans.values():
+            plan.unique_index = unique_index
+
         # Create form to pass context to the ImportResultSet
         # TODO: evaluate this, only added because of FlatRelatedField
         header_form = ModelCreateForm(data={}, caches={}, author=author)
         importresult = resultset_cls(headers=headers, header_form=header_form)
 
-        sid = transaction.savepoint()
-
         # Start processing
-        created = updated = skipped = failed = 0
-        for i, row in enumerate(rows, start=1):
-            errors = []
-            warnings = []
-            instance = None
-            to_be_created = (
-                row.get("id", "") == ""
-            )  # If ID is blank we are creating a new row, otherwise we are updating
-            to_be_updated = not to_be_created
-            to_be_skipped = skip_func(row) if skip_func else False
-            import_form_class = ModelCreateForm if to_be_created else ModelUpdateForm
-
-            # Evaluate skip first
-            # So that the import doesn't die for no reason
-            if to_be_skipped:
-                skipped += 1
-                continue
+        self.counts = dict(created=0, updated=0, skipped=0, failed=0)
+        # The line of the row updating each instance, as the rows of a batch share the instances being updated.
+        self.updated_lines = {}
+        checkpoint = None
+        if checkpoint_store is not None:
+            checkpoint = self._load_checkpoint(checkpoint_store, commit)
+            self.counts.update(checkpoint.counts)
+        bulk = bulk and commit
+        if transaction_strategy is None:
+            transaction_strategy = (
+                ChunkSavepointStrategy() if bulk else RowSavepointStrategy()
+            )
+        batched = bulk or transaction_strategy.batched
 
-            if to_be_created and not allow_insert:
-                errors = [("id", ["Creating new rows is not permitted"])]
-                importresult.append(i, row, errors, instance, to_be_created)
-                continue
+        write = partial(self._write_rows, commit=commit, bulk=bulk, profiler=profiler)
 
-            if to_be_updated and not allow_update:
-                errors = [("id", ["Updating existing rows is not permitted"])]
-                importresult.append(i, row, errors, instance, to_be_created)
-                continue
+        def process_batch(batch):
+            # Resolve the cached lookups for the whole batch up front, rather than a query per row.
+            batch_rows = [row for _, row in batch]
+            with profiler.phase("prefetch"):
+                for form_class in (ModelCreateForm, ModelUpdateForm):
+                    created = form_class.prefetch_caches(
+                        caches, batch_rows, commit=commit
+                    )
+                    for field, values in created.items():
+                        if values:
+                            importresult.add_created_lookups(field, values)
+            if allow_update:
+                with profiler.phase("update_lookup"):
+                    self.prefetch_for_update(
+                        (row["id"] for row in batch_rows if row.get("id", "") != ""),
+                        select_related=list(plans[ModelUpdateForm].flat_related),
+                    )
 
-            if to_be_updated:
-                try:
-                    instance = self.get_for_update(row["id"])
-                except ValueError as e:
-                    # We cannot validate an id's format until we try to fetch it from the DB
-                    if "expected a number" in str(e):
-                        errors = [
-                            (
-                                "id",
-                                [
-                                    f'{self.model._meta.verbose_name.title()} {row["id"]} is an invalid format for an ID.'
-                                ],
-                            )
-                        ]
-                    else:
-                        raise e
-                except self.model.DoesNotExist:
-                    errors = [
-                        (
-                            "id",
-                            [
-                                f'{self.model._meta.verbose_name.title()} {row["id"]} does not exist.'
-                            ],
-                        )
+            with profiler.phase("preparse"):
+                batch_data = (
+                    plans[ModelCreateForm].preparse(batch_rows)
+                    if preparse
+                    else batch_rows
+                )
+
+            # Batched strategies validate the whole batch before saving any of it, so its unique fields can be
+            # checked together. The others save each row as soon as it's validated, so rows can depend on rows
+            # saved earlier in the same file.
+            pending = []
+            for (i, row), data in zip(batch, batch_data):
+                to_be_created = (
+                    row.get("id", "") == ""
+                )  # If ID is blank we are creating a new row, otherwise we are updating
+                to_be_updated = not to_be_created
+                to_be_skipped = skip_func(row) if skip_func else False
+                import_form_class = (
+                    ModelCreateForm if to_be_created else ModelUpdateForm
+                )
+
+                # Evaluate skip first
+                # So that the import doesn't die for no reason
+                if to_be_skipped:
+                    self.counts["skipped"] += 1
+                    continue
+
+                pending_row = PendingRow(i, row, to_be_created, data=data)
+
+                if to_be_created and not allow_insert:
+                    pending_row.errors = [
+                        ("id", ["Creating new rows is not permitted"])
+                    ]
+                    pending_row.counted = False
+
+                elif to_be_updated and not allow_update:
+                    pending_row.errors = [
+                        ("id", ["Updating existing rows is not permitted"])
+                    ]
+                    pending_row.counted = False
+
+                else:
+                    self._validate_row(
+                        pending_row,
+                        import_form_class,
+                        plans[import_form_class],
+                        caches,
+                        author,
+                        profiler,
+                    )
+
+                pending.append(pending_row)
+                if not batched:
+                    save_rows([pending_row])
+                    self._add_result(pending_row, importresult, progress_logger)
+
+            if batched:
+                save_rows(pending)
+                for pending_row in pending:
+                    self._add_result(pending_row, importresult, progress_logger)
+
+            # The loaders held on to the values prefetched for the batch until now.
+            for loader in caches.values():
+                if isinstance(loader, CachedInstanceLoader):
+                    loader.release()
+            return pending
+
+        def save_rows(pending):
+            if unique_index is not None:
+                with profiler.phase("unique_check"):
+                    unique_index.check(pending)
+
+            to_save = [pending_row for pending_row in pending if pending_row.form]
+            if to_save:
+                with profiler.phase("save"):
+                    transaction_strategy.save(to_save, write)
+
+            # Rows rejected as duplicates of a row which then failed to save are validated (and saved) again.
+            retry = self._forget_failed_rows(pending, unique_index)
+            for pending_row in retry:
+                import_form_class = (
+                    ModelCreateForm if pending_row.to_be_created else ModelUpdateForm
+                )
+                self._validate_row(
+                    pending_row,
+                    import_form_class,
+                    plans[import_form_class],
+                    caches,
+                    author,
+                    profiler,
+                )
+            if retry:
+                save_rows(retry)
+
+        # A checkpointed import commits each batch as it goes, rather than the whole import at once.
+        with nullcontext() if checkpoint else transaction.atomic():
+            sid = transaction.savepoint()
+
+            for batch in chunked(enumerate(rows, start=start_line), batch_size):
+                if not checkpoint:
+                    process_batch(batch)
+                    continue
+
+                # Skip any lines committed by a previous run.
+                batch = [(i, row) for i, row in batch if i > checkpoint.line]
+                if not batch:
+                    continue
+                line = batch[-1][0]
+                with transaction.atomic():
+                    processed = process_batch(batch)
+                    created_ids = [
+                        str(pending_row.instance.pk)
+                        for pending_row in processed
+                        if pending_row.to_be_created and not pending_row.errors
                     ]
-                except KeyError:
+                    checkpoint_store.begin(line, self.counts, created_ids)
+                checkpoint_store.commit(line)
+
+            if commit:
+                transaction.savepoint_commit(sid)
+            else:
+                transaction.savepoint_rollback(sid)
+
+        if lookup_cache is not None:
+            if commit:
+                # The import may have changed the rows of its own model, so any lookups of them are stale.
+                lookup_cache.invalidate(self.model)
+            else:
+                # Don't leave the instances which weren't created for the preview in the shared loaders.
+                for field in importresult.get_created_lookups():
+                    caches[field].discard_unsaved()
+            # The values which weren't found may be created before the next import.
+            lookup_cache.discard_errors()
+            lookup_cache.trim()
+
+        importresult.set_counts(**self.counts)
+        profiler.record_caches(caches)
+        importresult.set_profile(profiler.get_stats())
+        profiler.export()
+        return importresult
+
+    async def aprocess(
+        self,
+        headers,
+        rows,
+        progress_logger=None,
+        batch_size=500,
+        executor=None,
+        **kwargs,
+    ):
+        """Process the data (as `process` does) without blocking the event loop, for use under ASGI.
+
+        The import runs in a thread of its own, with its own database connection (which is closed
+        once it's done), so it can't see data from a transaction open in the calling code.
+
+        @param rows Any iterable or async iterable of row dicts (e.g. from an upload stream). Async rows are
+            read a batch at a time, handing control back to the event loop in between.
+        @param progress_logger A callable, or coroutine function, which is passed each ImportResultRow.
+        @param executor A concurrent.futures.Executor to run the import in, instead of a new thread.
+        """
+        if asyncio.iscoroutinefunction(progress_logger):
+            progress_logger = async_to_sync(progress_logger)
+        if hasattr(rows, "__aiter__"):
+            rows = iter_async(rows, batch_size)
+
+        def process():
+            try:
+                return self.process(
+                    headers,
+                    rows,
+                    progress_logger=progress_logger,
+                    batch_size=batch_size,
+                    **kwargs,
+                )
+            finally:
+                connections.close_all()
+
+        return await sync_to_async(process, thread_sensitive=False, executor=executor)()
+
+    def preview_parallel(
+        self,
+        headers,
+        rows,
+        workers=None,
+        shard_size=5000,
+        executor=None,
+        author=None,
+        progress_logger=None,
+        resultset_cls=ImportResultSet,
+        **kwargs,
+    ):
+        """Preview the data (as `process` does with commit=False), sharding the rows across a pool of processes.
+
+        Each worker process has its own database connection and keeps its lookup caches warm across the
+        shards it previews (per thread, if given an executor which runs them in threads). The results are
+        merged back into a single result set in line order, which is when the rows that repeat a unique
+        value or updated id from an earlier shard are failed.
+
+        @param workers The number of worker processes (defaults to the number of CPUs).
+        @param shard_size The number of rows sent to a worker at a time.
+        @param executor A concurrent.futures.Executor to use instead of creating a process pool.
+        @param kwargs Any other arguments for `process`. These are sent to the workers, so must be picklable.
+        """
+        kwargs["author"] = author
+        kwargs["limit_to_queryset"] = parallel.pickle_queryset(
+            kwargs.get("limit_to_queryset")
+        )
+        preview_id = uuid.uuid4()
+
+        # Results are read back in order, with a limited number of shards in flight to bound memory use.
+        max_in_flight = (workers or os.cpu_count() or 1) * 2
+        own_executor = executor is None
+        if own_executor:
+            if transaction.get_connection().in_atomic_block:
+                raise TransactionManagementError(
+                    "Worker processes can't see data from an open transaction."
+                )
+            # Worker processes must not share the parent's database connections.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=parallel.init_worker
+            )
+
+        header_form = FormClassBuilder(
+            self.modelimportformclass, headers
+        ).build_create_form()(data={}, caches={}, author=author)
+        importresult = resultset_cls(headers=headers, header_form=header_form)
+        counts = [0, 0, 0, 0]
+        # Each worker only checks for duplicates within its own shards, so check across them here.
+        unique_index = UniquenessIndex.for_model(self.model)
+        updated_lines = {}
+
+        def merge(future):
+            results, shard_counts, created_lookups, (seen, shard_updated_lines) = (
+                future.result()
+            )
+            for field, values in created_lookups.items():
+                # Each worker finds its own missing values, so the same ones may be found more than once.
+                known = set(importresult.get_created_lookups().get(field, []))
+                values = [value for value in values if value not in known]
+                if values:
+                    importresult.add_created_lookups(field, values)
+            for i, count in enumerate(shard_counts):
+                counts[i] += count
+
+            duplicates = {}
+            for pk, line in shard_updated_lines.items():
+                if pk in updated_lines:
+                    duplicates[line] = updated_lines[pk]
+                else:
+                    updated_lines[pk] = line
+            unique_errors = (
+                unique_index.merge(seen, exclude=duplicates)
+                if unique_index is not None
+                else {}
+            )
+
+            for linenumber, row, errors, instance, created, warnings in results:
+                if linenumber in duplicates or linenumber in unique_errors:
+                    errors = (
+                        self._duplicate_update_errors(row, duplicates[linenumber])
+                        if linenumber in duplicates
+                        else unique_errors[linenumber]
+                    )
+                    # The row was counted as valid by its worker.
+                    counts[0 if created else 1] -= 1
+                    if instance is not None and instance.pk:
+                        counts[3] += 1
+                result_row = importresult.append(
+                    linenumber, row, errors, instance, created, warnings
+                )
+                if progress_logger:
+                    progress_logger(result_row)
+
+        try:
+            in_flight = deque()
+            start_line = 1
+            for shard in chunked(rows, shard_size):
+                in_flight.append(
+                    executor.submit(
+                        parallel.preview_shard,
+                        preview_id,
+                        type(self),
+                        self.modelimportformclass,
+                        headers,
+                        shard,
+                        start_line,
+                        kwargs,
+                    )
+                )
+                start_line += len(shard)
+                if len(in_flight) >= max_in_flight:
+                    merge(in_flight.popleft())
+            while in_flight:
+                merge(in_flight.popleft())
+        finally:
+            if own_executor:
+                executor.shutdown(cancel_futures=True)
+
+        created, updated, skipped, failed = counts
+        importresult.set_counts(
+            created=created, updated=updated, skipped=skipped, failed=failed
+        )
+        return importresult
+
+    def _load_checkpoint(self, checkpoint_store, commit):
+        if not commit:
+            raise ValueError("Checkpointed imports must be committed.")
+        if transaction.get_connection().in_atomic_block:
+            raise TransactionManagementError(
+                "Checkpointed imports commit each batch, so can't run inside a transaction."
+            )
+
+        def is_committed(created_ids):
+            return self.model._base_manager.filter(pk=created_ids[-1]).exists()
+
+        return checkpoint_store.load(is_committed)
+
+    def _validate_row(
+        self, pending_row, import_form_class, plan, caches, author, profiler
+    ):
+        """Fetch the instance being updated (if any) and validate the row against the import form.
+
+        If the row is valid, the form is left on `pending_row` ready to be saved.
+        """
+        row = pending_row.row
+        instance = None
+        errors = []
+
+        if not pending_row.to_be_created:
+            try:
+                with profiler.phase("update_lookup"):
+                    instance = self.get_for_update(row["id"])
+            except ValueError as e:
+                # We cannot validate an id's format until we try to fetch it from the DB
+                if "expected a number" in str(e):
                     errors = [
                         (
                             "id",
                             [
-                                f'{self.model._meta.verbose_name.title()} {row["id"]} cannot be updated.'
+                                f'{self.model._meta.verbose_name.title()} {row["id"]} is an invalid format for an ID.'
                             ],
                         )
                     ]
+                else:
+                    raise e
+            except self.model.DoesNotExist:
+                errors = [
+                    (
+                        "id",
+                        [
+                            f'{self.model._meta.verbose_name.title()} {row["id"]} does not exist.'
+                        ],
+                    )
+                ]
+            except KeyError:
+                errors = [
+                    (
+                        "id",
+                        [
+                            f'{self.model._meta.verbose_name.title()} {row["id"]} cannot be updated.'
+                        ],
+                    )
+                ]
+
+        if instance is not None and instance.pk in self.updated_lines:
+            pending_row.duplicates.add(self.updated_lines[instance.pk])
+            errors = self._duplicate_update_errors(row, self.updated_lines[instance.pk])
 
-            if not errors:
+        if not errors:
+            with profiler.phase("form_init"):
                 form = import_form_class(
-                    row, caches=caches, instance=instance, author=author
+                    pending_row.data,
+                    caches=caches,
+                    instance=instance,
+                    author=author,
+                    profiler=profiler,
+                    plan=plan,
                 )
-                if form.is_valid():
-                    try:
-                        with transaction.atomic():
-                            instance = form.save(commit=commit)
-
-                        if to_be_created:
-                            created += 1
-                        if to_be_updated:
-                            updated += 1
-                    except Exception as err:
-                        errors = [(i, repr(err))]
+            with profiler.phase("is_valid"):
+                is_valid = form.is_valid()
+            if is_valid:
+                pending_row.form = form
+                if instance is not None:
+                    self.updated_lines[instance.pk] = pending_row.linenumber
+            else:
+                # TODO: Filter out errors associated with FlatRelatedField
+                errors = list(form.errors.items())
 
-                else:
-                    # TODO: Filter out errors associated with FlatRelatedField
-                    errors = list(form.errors.items())
+            pending_row.warnings = list(form.warnings.items())
+
+        pending_row.instance = instance
+        pending_row.errors = errors
 
-                warnings = list(form.warnings.items())
+    def _duplicate_update_errors(self, row, line):
+        return [
+            (
+                "id",
+                [
+                    f'{self.model._meta.verbose_name.title()} {row["id"]} is already updated on line {line}.'
+                ],
+            )
+        ]
+
+    def _forget_failed_rows(self, pending_rows, unique_index):
+        """Forget the unique values and updated ids of the rows which failed to save, so later rows may use them.
+
+        Returns the rows which were rejected as duplicates of them, reset ready to be validated again.
+        """
+        failed = {}
+        for pending_row in pending_rows:
+            if not pending_row.form or not pending_row.errors:
+                continue
+            failed[pending_row.linenumber] = pending_row
+            if unique_index is not None:
+                unique_index.forget(pending_row)
+            instance = pending_row.form.instance
+            if (
+                not pending_row.to_be_created
+                and self.updated_lines.get(instance.pk) == pending_row.linenumber
+            ):
+                del self.updated_lines[instance.pk]
 
-            if not instance or not instance.pk or errors:
-                failed += 1
+        retry = [
+            pending_row
+            for pending_row in pending_rows
+            if pending_row.duplicates & failed.keys()
+        ]
+        if retry:
+            for pending_row in failed.values():
+                if not pending_row.to_be_created:
+                    # The instance is shared with any other rows updating it, and was changed by the failed row's form.
+                    pending_row.form.instance.refresh_from_db()
+        for pending_row in retry:
+            pending_row.errors = []
+            pending_row.warnings = []
+            pending_row.form = None
+            pending_row.instance = None
+            pending_row.duplicates = set()
+        return retry
 
-            result_row = importresult.append(
-                i, row, errors, instance, to_be_created, warnings
+    def _write_rows(self, pending_rows, commit, bulk, profiler):
+        """Save a list of valid rows, using bulk_create / bulk_update when in bulk mode."""
+        for pending_row in pending_rows:
+            form = pending_row.form
+            to_insert = [form.instance] if pending_row.to_be_created else []
+            to_insert.extend(
+                form.flat_related_instances[field]
+                for field in form.flat_related_created
             )
-            if progress_logger:
-                progress_logger(result_row)
+            for instance in to_insert:
+                if not instance._state.adding:
+                    # A previous attempt to write this row was rolled back, so it needs inserting again.
+                    instance.pk = None
+                    instance._state.adding = True
 
-        if commit:
-            transaction.savepoint_commit(sid)
-        else:
-            transaction.savepoint_rollback(sid)
+        if not bulk or len(pending_rows) == 1:
+            for pending_row in pending_rows:
+                pending_row.instance = pending_row.form.save(commit=commit)
+            return
 
-        importresult.set_counts(
-            created=created, updated=updated, skipped=skipped, failed=failed
+        to_create = []
+        to_update = []
+        update_fields = set()
+        concrete_fields = {
+            field.name
+            for field in self.model._meta.concrete_fields
+            if not field.primary_key
+        }
+
+        self._write_flat_related(pending_rows, profiler)
+
+        for pending_row in pending_rows:
+            instance = pending_row.form.save(commit=False)
+            pending_row.instance = instance
+            if pending_row.to_be_created:
+                to_create.append(instance)
+            else:
+                to_update.append(instance)
+                update_fields.update(
+                    concrete_fields.intersection(pending_row.form.cleaned_data)
+                )
+
+        if to_create:
+            create_instances(self.model, to_create)
+        if to_update and update_fields:
+            self.model._default_manager.bulk_update(to_update, update_fields)
+
+        for pending_row in pending_rows:
+            pending_row.form.save_m2m()
+
+    def _write_flat_related(self, pending_rows, profiler):
+        """Write the related instances of any FlatRelatedFields for a batch of rows, ahead of the rows themselves.
+
+        Related instances are created with bulk_create, and updated with a bulk_update per model. Should several
+        rows update the same instance, their changes are merged in line order so it's only updated once.
+        """
+        to_create = defaultdict(list)
+        to_update = defaultdict(dict)
+        update_fields = defaultdict(set)
+
+        for pending_row in pending_rows:
+            form = pending_row.form
+            for field, instance in form.flat_related_instances.items():
+                model = type(instance)
+                if instance._state.adding:
+                    to_create[model].append(instance)
+                    continue
+                fields = form.flat_related_fields[field]
+                merged = to_update[model].setdefault(instance.pk, instance)
+                if merged is not instance:
+                    for name in fields:
+                        attname = model._meta.get_field(name).attname
+                        setattr(merged, attname, getattr(instance, attname))
+                update_fields[model].update(fields)
+
+        if not to_create and not to_update:
+            return
+
+        with profiler.phase("flat_related_save"):
+            for model, instances in to_create.items():
+                create_instances(model, instances)
+            for model, instances in to_update.items():
+                if update_fields[model]:
+                    model._default_manager.bulk_update(
+                        instances.values(), update_fields[model]
+                    )
+
+        for pending_row in pending_rows:
+            form = pending_row.form
+            for field, instance in form.flat_related_instances.items():
+                setattr(form.instance, field, instance)
+
+    def _add_result(self, pending_row, importresult, progress_logger):
+        instance = pending_row.instance
+        errors = pending_row.errors
+
+        if pending_row.form and not errors:
+            if pending_row.to_be_created:
+                self.counts["created"] += 1
+            else:
+                self.counts["updated"] += 1
+
+        if not pending_row.counted:
+            importresult.append(
+                pending_row.linenumber,
+                pending_row.row,
+                errors,
+                instance,
+                pending_row.to_be_created,
+            )
+            return
+
+        if not instance or not instance.pk or errors:
+            self.counts["failed"] += 1
+
+        result_row = importresult.append(
+            pending_row.linenumber,
+            pending_row.row,
+            errors,
+            instance,
+            pending_row.to_be_created,
+            pending_row.warnings,
         )
-        return importresult
+        if progress_logger:
+            progress_logger(result_row)
@@ -1,14 +1,17 @@
 import datetime
 import json
 import re
-from typing import Any, Iterable
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
 
 from dateutil import parser
 from django import forms
+from django.core.exceptions import EmptyResultSet, ImproperlyConfigured
 from django.db.models import QuerySet
 from django.forms import Field
 from django.forms.utils import from_current_timezone
 
+from .loaders import CachedInstanceLoader, PreloadedInstanceLoader
 from .widgets import JSONFieldWidget
 
 
@@ -47,6 +50,15 @@ class CachedChoiceField(UseCacheMixin, forms.Field):
 
     If you expect a larger number of different values, you might want to use a
     PreloadedChoiceField.
+
+    To bound the memory used by the cache on long imports, pass `max_entries`,
+    `max_negative_entries` or `pk_only` (see CachedInstanceLoader).
+
+    Pass `create_missing=True` to create the values which don't exist (with the
+    `to_field`s set), rather than failing the rows which use them. Pass a callable
+    instead to build the unsaved instance for a value yourself, which is required
+    if the queryset is filtered. Instances which fail `full_clean()` aren't created,
+    and their rows fail instead.
     """
 
     def __init__(
@@ -55,14 +67,72 @@ class CachedChoiceField(UseCacheMixin, forms.Field):
         to_field: str | Iterable[str] = None,
         none_if_missing: Any = None,
         *args: Any,
+        max_entries: int | None = None,
+        max_negative_entries: int | None = None,
+        pk_only: bool = False,
+        create_missing: bool | Callable[[Any], Any] = False,
         **kwargs: Any,
     ) -> None:
         self.queryset = queryset
         self.model = queryset.model
         self.to_field = to_field
         self.none_if_missing = none_if_missing or []
+        self.create_missing = create_missing
+        if create_missing is True and any(
+            "__" in field for field in self.get_to_fields()
+        ):
+            raise ImproperlyConfigured(
+                "create_missing can't create values for a to_field which spans relations, "
+                "pass a callable which builds the instance instead."
+            )
+        if create_missing is True and queryset.query.where:
+            raise ImproperlyConfigured(
+                "create_missing can't create values which match a filtered queryset, "
+                "pass a callable which builds the instance instead."
+            )
+        # Options for the loader, see CachedInstanceLoader
+        self.loader_options = dict(
+            max_entries=max_entries,
+            max_negative_entries=max_negative_entries,
+            pk_only=pk_only,
+        )
         super().__init__(*args, **kwargs)
 
+    def get_loader(self) -> CachedInstanceLoader:
+        return CachedInstanceLoader(self.queryset, self.to_field, **self.loader_options)
+
+    def get_loader_key(self) -> tuple[Any, ...]:
+        """Identify the lookups made by the field's loader, so fields making the same lookups can share one."""
+        try:
+            sql, params = self.queryset.query.sql_with_params()
+        except EmptyResultSet:
+            sql, params = None, ()
+        to_field = (
+            tuple(self.to_field)
+            if isinstance(self.to_field, (list, tuple))
+            else self.to_field
+        )
+        return (
+            type(self),
+            self.queryset.db,
+            sql,
+            tuple(params),
+            to_field,
+            tuple(self.loader_options.items()),
+        )
+
+    def get_to_fields(self) -> list[str]:
+        if isinstance(self.to_field, (list, tuple)):
+            return list(self.to_field)
+        return [self.to_field]
+
+    def build_missing(self, value: Any) -> Any:
+        """Return an unsaved instance for a value which doesn't exist, for `create_missing`."""
+        if callable(self.create_missing):
+            return self.create_missing(value)
+        values = value if isinstance(self.to_field, (list, tuple)) else [value]
+        return self.model(**dict(zip(self.get_to_fields(), values)))
+
     def get_from_cache(self, value: Any) -> Any:
         return self.instancecache[value]
 
@@ -97,13 +167,52 @@ class CachedChoiceField(UseCacheMixin, forms.Field):
             )
 
 
-class PreloadedChoiceField(forms.Field):
+class PreloadedChoiceField(CachedChoiceField):
     """This will load all the possible values for this relationship once,
     to avoid hitting the database for each relationship in the import.
+
+    Only the primary keys are loaded up front; instances are fetched for the values
+    which are actually used. Pass `compact=True` for very large tables to hold the
+    index in sorted arrays rather than a dict.
     """
 
-    def clean(self, value: Any) -> Any:
-        raise NotImplementedError
+    def __init__(
+        self,
+        queryset: QuerySet,
+        to_field: str | Iterable[str] = None,
+        none_if_missing: Any = None,
+        compact: bool = False,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        self.compact = compact
+        super().__init__(queryset, to_field, none_if_missing, *args, **kwargs)
+
+    def get_loader(self) -> PreloadedInstanceLoader:
+        return PreloadedInstanceLoader(
+            self.queryset, self.to_field, self.compact, **self.loader_options
+        )
+
+    def get_loader_key(self) -> tuple[Any, ...]:
+        return super().get_loader_key() + (self.compact,)
+
+
+# The fixed formats tried before falling back to dateutil, by the order of the day, month and year.
+# Two digit years are left to dateutil, as its century window differs from strptime's.
+DATE_FORMATS = {
+    "year_first": ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d"),
+    "day_first": ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y"),
+    "month_first": ("%m/%d/%Y", "%m-%d-%Y", "%m.%d.%Y"),
+}
+TIME_FORMATS = (
+    "",
+    " %H:%M",
+    " %H:%M:%S",
+    " %H:%M:%S.%f",
+    "T%H:%M",
+    "T%H:%M:%S",
+    "T%H:%M:%S.%f",
+)
 
 
 class DateTimeParserField(forms.DateTimeField):
@@ -121,27 +230,127 @@ class DateTimeParserField(forms.DateTimeField):
     - XXXX/XX/XX -> YYYY/MM/DD
     """
 
+    # The number of parsed values to remember, as the same dates tend to be repeated throughout a file.
+    cache_size = 1000
+    # The number of values which don't match the inferred format that are used to infer it again,
+    # after which it's fixed for the rest of the import.
+    sample_size = 20
+
     def __init__(self, middle_endian: bool = False, *args: Any, **kwargs: Any):
         self.middle_endian = middle_endian
         super().__init__(*args, **kwargs)
-
-    def to_python(self, value: str) -> datetime.datetime:
-        value = (value or "").strip()
-        if value:
+        self.reset()
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> "DateTimeParserField":
+        result = super().__deepcopy__(memo)
+        # Each copy of the field (i.e. each import) infers its own format.
+        result.reset()
+        return result
+
+    def reset(self) -> None:
+        """Forget the inferred format and the parsed values."""
+        self.inferred_format = None
+        self.sampled = 0
+        self.parsed_values = OrderedDict()
+
+    def get_formats(self) -> list[str]:
+        """Return the strptime formats which read a value the same way dateutil does for this field."""
+        dates = DATE_FORMATS["year_first"] + (
+            DATE_FORMATS["month_first"]
+            if self.middle_endian
+            else DATE_FORMATS["day_first"]
+        )
+        return [date + time for date in dates for time in TIME_FORMATS]
+
+    def infer_format(self, value: str) -> str | None:
+        """Return the first format which parses the value, if any."""
+        for format in self.get_formats():
+            try:
+                datetime.datetime.strptime(value, format)
+            except ValueError:
+                continue
+            return format
+        return None
+
+    def parse_with_format(self, value: str) -> datetime.datetime | None:
+        """Parse the value with the inferred format, returning None if it doesn't match.
+
+        The format is inferred from the first value, and again from each value which doesn't
+        match it, until `sample_size` values haven't matched.
+        """
+        if self.inferred_format:
             try:
-                dayfirst = (
-                    not bool(re.match(r"^\d{4}.\d\d?.\d\d?", value))
-                    and not self.middle_endian
-                )
-                return from_current_timezone(parser.parse(value, dayfirst=dayfirst))
-            except (TypeError, ValueError, OverflowError):
-                raise forms.ValidationError(
-                    self.error_messages["invalid"], code="invalid"
-                )
+                return datetime.datetime.strptime(value, self.inferred_format)
+            except ValueError:
+                pass
+
+        if self.sampled >= self.sample_size:
+            return None
+        self.sampled += 1
+        format = self.infer_format(value)
+        if format is None:
+            return None
+        self.inferred_format = format
+        return datetime.datetime.strptime(value, format)
+
+    def parse_with_dateutil(self, value: str) -> datetime.datetime | None:
+        dayfirst = (
+            not bool(re.match(r"^\d{4}.\d\d?.\d\d?", value)) and not self.middle_endian
+        )
+        try:
+            return parser.parse(value, dayfirst=dayfirst)
+        except (TypeError, ValueError, OverflowError):
+            return None
 
+    def parse(self, value: str, fallback: bool = True) -> datetime.datetime | None:
+        """Parse a stripped value, returning None if it isn't a date.
+
+        The value is parsed with the inferred format, falling back to dateutil if it doesn't match
+        (unless `fallback` is False). The last `cache_size` values are remembered.
+        """
+        try:
+            parsed = self.parsed_values[value]
+        except KeyError:
+            parsed = self.parse_with_format(value)
+            if parsed is None:
+                if not fallback:
+                    return None
+                parsed = self.parse_with_dateutil(value)
+            self.parsed_values[value] = parsed
+            if len(self.parsed_values) > self.cache_size:
+                self.parsed_values.popitem(last=False)
         else:
+            self.parsed_values.move_to_end(value)
+        return parsed
+
+    def parse_column(self, values: Iterable[Any]) -> list[Any]:
+        """Parse a column of values with the inferred format.
+
+        This is much faster than parsing each value with dateutil. Values which don't match the
+        format are returned as they are, to be parsed (or rejected) by `to_python`.
+        """
+        parsed = []
+        for value in values:
+            if isinstance(value, str):
+                value = value.strip()
+                if value:
+                    value = self.parse(value, fallback=False) or value
+            parsed.append(value)
+        return parsed
+
+    def to_python(self, value: str | datetime.datetime) -> datetime.datetime:
+        if isinstance(value, datetime.datetime):
+            # Already parsed by `parse_column`
+            return from_current_timezone(value)
+        value = (value or "").strip()
+        if not value:
             return None
 
+        parsed = self.parse(value)
+        if parsed is None:
+            raise forms.ValidationError(self.error_messages["invalid"], code="invalid")
+        return from_current_timezone(parsed)
+
 
 class JSONField(forms.Field):
     """This lets you store any fields prefixed by the field name into a JSON blob.
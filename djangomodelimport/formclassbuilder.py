@@ -1,10 +1,15 @@
+import copy
+import threading
+from collections import OrderedDict
 from functools import cached_property
-from typing import TypeVar, TYPE_CHECKING
+from typing import Callable, TypeVar, TYPE_CHECKING
 
 from django.db.models.fields import NOT_PROVIDED
 from django.forms import modelform_factory
 
 from .fields import JSONField, FlatRelatedField
+from .utils import get_field_signature
+from .widgets import JSONFieldWidget
 
 if TYPE_CHECKING:
     from . import ImporterModelForm  # NOQA
@@ -13,7 +18,16 @@ _ImporterForm = TypeVar("_ImporterForm", bound="ImporterModelForm")
 
 
 class FormClassBuilder:
-    """Constructs instances of ImporterModelForm, taking headers into account."""
+    """Constructs instances of ImporterModelForm, taking headers into account.
+
+    The built form classes are memoised across imports, keyed by the importer class (and its
+    fields) and the set of headers, so repeat imports of the same shape of file skip
+    `modelform_factory` entirely.
+    """
+
+    form_class_cache = OrderedDict()
+    form_class_cache_size = 256
+    _form_class_cache_lock = threading.Lock()
 
     def __init__(self, modelimportformclass: _ImporterForm, headers: list[str]) -> None:
         self.headers = headers
@@ -21,14 +35,40 @@ class FormClassBuilder:
         self.model = modelimportformclass.Meta.model
 
     def build_update_form(self) -> _ImporterForm:
-        return self._get_modelimport_form_class(fields=self.valid_fields)
+        return self._get_cached_form_class(
+            "update", lambda: self._get_modelimport_form_class(fields=self.valid_fields)
+        )
 
     def build_create_form(self) -> _ImporterForm:
-        # Combine valid & required fields; preserving order of valid fields.
-        form_fields = self.valid_fields + list(
-            set(self.required_fields) - set(self.valid_fields)
+        def build():
+            # Combine valid & required fields; preserving order of valid fields.
+            form_fields = self.valid_fields + list(
+                set(self.required_fields) - set(self.valid_fields)
+            )
+            return self._get_modelimport_form_class(fields=form_fields)
+
+        return self._get_cached_form_class("create", build)
+
+    def _get_cached_form_class(
+        self, kind: str, build: Callable[[], _ImporterForm]
+    ) -> _ImporterForm:
+        key = (
+            self.modelimportformclass,
+            get_field_signature(self.modelimportformclass),
+            frozenset(self.headers),
+            kind,
         )
-        return self._get_modelimport_form_class(fields=form_fields)
+        with self._form_class_cache_lock:
+            if key in self.form_class_cache:
+                self.form_class_cache.move_to_end(key)
+                return self.form_class_cache[key]
+
+        klass = build()
+        with self._form_class_cache_lock:
+            self.form_class_cache[key] = klass
+            while len(self.form_class_cache) > self.form_class_cache_size:
+                self.form_class_cache.popitem(last=False)
+        return klass
 
     @cached_property
     def valid_fields(self) -> list[str]:
@@ -43,10 +83,15 @@ class FormClassBuilder:
         # see if they evaluate to a field
         valid_present_fields = set()
         for field_name, field_meta in form_field_metadata.items():
-            if isinstance(field_meta.field, (FlatRelatedField, JSONField)):
+            if isinstance(field_meta.field, FlatRelatedField):
                 # FlatRelatedField: these are a collection of other columns that build a relation on the fly. Always add.
-                # JSONField: these are provided as FIELDNAME__SOME_DATA, so won't match directly. Just let the whole thing through.
                 valid_present_fields.add(field_name)
+            elif isinstance(field_meta.field, JSONField) and isinstance(
+                field_meta.field.widget, JSONFieldWidget
+            ):
+                # JSONField: these are provided as FIELDNAME_SOME_DATA, so won't match directly. Add if any of them are present.
+                if field_meta.field.widget.resolve_columns(field_name, self.headers):
+                    valid_present_fields.add(field_name)
             else:
                 for source in field_meta.sources:
                     if {key for key, _ in source} <= set(self.headers):
@@ -87,4 +132,13 @@ class FormClassBuilder:
         base_fields_to_del = set(klass.base_fields.keys()) - set(fields)
         for f in base_fields_to_del:
             del klass.base_fields[f]
+        # Every row has the same headers, so work out which columns belong to each JSONField up front.
+        for name, field in list(klass.base_fields.items()):
+            if isinstance(field.widget, JSONFieldWidget):
+                # The field is shared with the importer class, so give this form class its own copy.
+                field = klass.base_fields[name] = copy.deepcopy(field)
+                field.widget.columns = field.widget.resolve_columns(name, self.headers)
+        # Every row has the same headers, so pick the actual fields for any switchers up front.
+        klass.resolve_source_field_switchers(self.headers)
+        klass.source_field_switchers_resolved = True
         return klass
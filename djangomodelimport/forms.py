@@ -1,5 +1,6 @@
 from collections import defaultdict
 from functools import partial
+from weakref import WeakKeyDictionary
 
 from django import forms
 from django.core.exceptions import NON_FIELD_ERRORS
@@ -11,9 +12,14 @@ from .magic import (
     JSONFieldFormMixin,
     SourceFieldSwitcherMixin,
 )
-from .utils import HasSource, ImportFieldMetadata
+from .plan import ImportRowPlan
+from .profiling import NullProfiler
+from .utils import HasSource, ImportFieldMetadata, get_field_signature
 from .widgets import CompositeLookupWidget
 
+# Field metadata for each importer class, along with the field signature it was generated from.
+_field_metadata_cache = WeakKeyDictionary()
+
 
 class ImporterModelForm(
     SourceFieldSwitcherMixin,
@@ -26,12 +32,25 @@ class ImporterModelForm(
     routines to ensure we are not doing too many queries with our cached fields.
     """
 
-    def __init__(self, data, caches, author=None, *args, **kwargs) -> None:
+    def __init__(
+        self, data, caches, author=None, profiler=None, plan=None, *args, **kwargs
+    ) -> None:
         self.caches = caches
         self.author = author
+        self.profiler = profiler or NullProfiler()
+        self.plan = plan
+        if plan is not None:
+            # Copy the plan's fields, which are already bound to the import's caches.
+            self.base_fields = plan.fields
         self._warnings = defaultdict(list)
         super().__init__(data, *args, **kwargs)
 
+    def get_row_plan(self) -> ImportRowPlan:
+        """Return the plan passed in by the importer, or work one out for this form alone."""
+        if self.plan is None:
+            self.plan = ImportRowPlan(self.fields, self.caches)
+        return self.plan
+
     def add_warning(self, field: str, warning: str) -> None:
         # Mimic django form behaviour for errors
         if not field:
@@ -43,9 +62,20 @@ class ImporterModelForm(
     def warnings(self) -> dict[str, list[str]]:
         return dict(self._warnings)
 
-    # This improves preview performance but eliminates validation on uniqueness constraints
-    # def validate_unique(self):
-    #     pass
+    def validate_unique(self) -> None:
+        # The importer checks uniqueness a batch at a time with its UniquenessIndex, rather than a query per row.
+        if self.plan is None or self.plan.unique_index is None:
+            super().validate_unique()
+
+    def get_unique_exclusions(self) -> set[str]:
+        """Return the fields to leave out of the uniqueness checks.
+
+        These are the same as Django's, except for the cached fields, which are cheap to check a batch at a time.
+        """
+        return (
+            set(self._get_validation_exclusions())
+            - self.get_row_plan().validation_exclusions
+        )
 
     @classmethod
     def get_available_headers(cls) -> list[tuple[str, str]]:
@@ -69,6 +99,21 @@ class ImporterModelForm(
 
     @classmethod
     def get_field_metadata(cls) -> dict[str, ImportFieldMetadata]:
+        """Return a dict of available fields for the ImporterClass.
+
+        The metadata is generated once per class, and regenerated if the class's fields change.
+        """
+        signature = get_field_signature(cls)
+        cached = _field_metadata_cache.get(cls)
+        if cached is None or cached[0] != signature:
+            cached = _field_metadata_cache[cls] = (
+                signature,
+                cls._build_field_metadata(),
+            )
+        return dict(cached[1])
+
+    @classmethod
+    def _build_field_metadata(cls) -> dict[str, ImportFieldMetadata]:
         """Generate a dict of available fields for the ImporterClass"""
         # 1) Evaluate Field type:
         # - SourceFieldSwitcher: these are a collection of different ways to find a related object.
@@ -83,7 +128,7 @@ class ImporterModelForm(
         #     but not listed as form fields (eg because they're used for postprocessing).
 
         # Gather help_texts and verbose_names from the model and importer class
-        help_texts = getattr(cls.Meta, "help_texts", {})
+        help_texts = dict(getattr(cls.Meta, "help_texts", {}))
         model_fields = {
             field.name: {
                 "label": field.verbose_name.title(),
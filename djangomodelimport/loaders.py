@@ -1,15 +1,44 @@
-from typing import Iterable, Any, TypeVar
+import operator
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from functools import reduce
+from typing import Any, Callable, Iterable, TypeVar
 
-from django.db.models import QuerySet
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q, QuerySet
+
+from .utils import chunked, create_instances
 
 T = TypeVar("T")
 
 
+def is_field_path(model: Any, path: str) -> bool:
+    """Return whether a lookup only follows fields (e.g. "type__name"), rather than ending in a lookup such as "__iexact"."""
+    opts = model._meta
+    parts = path.split("__")
+    for i, part in enumerate(parts):
+        try:
+            field = opts.pk if part == "pk" else opts.get_field(part)
+        except FieldDoesNotExist:
+            return False
+        if i < len(parts) - 1:
+            if not field.is_relation:
+                return False
+            opts = field.related_model._meta
+    return True
+
+
 class CachedInstanceLoader(dict):
     """A clever cache that queries the database for any missing objects.
 
     If there's an error, it's only raised against the first item that causes it, then it's
     cached for extra speed.
+
+    By default the cache grows with every distinct value looked up. To bound it, pass `max_entries`
+    to evict the least recently used instances, and `max_negative_entries` to evict the oldest
+    errors. Pass `pk_only=True` to cache just the primary keys, and return deferred instances
+    (which only load their other fields if they're accessed).
     """
 
     def __init__(
@@ -17,14 +46,36 @@ class CachedInstanceLoader(dict):
         queryset: QuerySet[T],
         to_field: str | Iterable[str],
         *args: Any,
+        max_entries: int | None = None,
+        max_negative_entries: int | None = None,
+        pk_only: bool = False,
         **kwargs: Any,
     ):
         self.queryset = queryset
         self.model = queryset.model
         self.to_field = to_field
         self.multifield = isinstance(to_field, list) or isinstance(to_field, tuple)
+        self.max_entries = max_entries
+        self.max_negative_entries = max_negative_entries
+        self.pk_only = pk_only
+        self.bounded = max_entries is not None or max_negative_entries is not None
+        # Lookups such as "name__iexact" can't be matched back to their values, so are left to `__missing__`.
+        self.prefetchable = all(
+            is_field_path(self.model, to_field)
+            for to_field in (to_field if self.multifield else [to_field])
+        )
+        # The cached errors, oldest first, if the cache is bounded.
+        self.negative_keys = OrderedDict()
+        # Whether eviction is put off until `release`, see `hold`.
+        self.held = False
+        # Counters for the ImportProfiler: lookups made, lookups which needed their own query,
+        # and values resolved in bulk by `prefetch`.
+        self.lookups = 0
+        self.misses = 0
+        self.prefetched = 0
 
     def __getitem__(self, item: str) -> T:
+        self.lookups += 1
         # Attempt to get the currently cached value.
         value = super(CachedInstanceLoader, self).__getitem__(item)
 
@@ -32,16 +83,298 @@ class CachedInstanceLoader(dict):
         if isinstance(value, Exception):
             raise value
 
+        if self.max_entries is not None:
+            # Move it to the end, as the most recently used
+            dict.__delitem__(self, item)
+            dict.__setitem__(self, item, value)
+        if self.pk_only and not isinstance(value, self.model):
+            return self.hydrate(value)
         return value
 
+    def __setitem__(self, key: Any, value: Any) -> None:
+        super().__setitem__(key, value)
+        if not self.bounded:
+            return
+
+        if isinstance(value, Exception):
+            self.negative_keys[key] = None
+        else:
+            self.negative_keys.pop(key, None)
+        if not self.held:
+            self.trim()
+
+    def hold(self) -> None:
+        """Put off evicting any entries until `release`, e.g. so the values prefetched for a batch are
+        still cached when its rows are cleaned, however many distinct values it has."""
+        self.held = True
+
+    def release(self) -> None:
+        """Evict the entries held past the cache's limits since `hold`."""
+        self.held = False
+        if self.bounded:
+            self.trim()
+
+    def trim(self) -> None:
+        """Evict the oldest errors past `max_negative_entries`, and least recently used instances past `max_entries`."""
+        if self.max_negative_entries is not None:
+            while len(self.negative_keys) > self.max_negative_entries:
+                oldest, _ = self.negative_keys.popitem(last=False)
+                dict.__delitem__(self, oldest)
+        if self.max_entries is not None:
+            excess = len(self) - len(self.negative_keys) - self.max_entries
+            if excess > 0:
+                oldest = [key for key in self if key not in self.negative_keys][:excess]
+                for key in oldest:
+                    dict.__delitem__(self, key)
+
     def __missing__(self, value: str) -> T:
+        self.misses += 1
         if self.multifield:
             params = dict(zip(self.to_field, value))
         else:
             params = {self.to_field: value}
 
+        queryset = (
+            self.queryset.values_list("pk", flat=True)
+            if self.pk_only
+            else self.queryset
+        )
+        try:
+            self[value] = inst = queryset.get(**params)
+        except self.model.DoesNotExist as err:
+            self[value] = err  # Further warnings will be re-raised
+            raise
+        except self.model.MultipleObjectsReturned as err:
+            self[value] = err  # Further warnings will be re-raised
+            raise
+        return inst
+
+    def create_missing(
+        self, values: Iterable[Any], build: Callable[[Any], T], commit: bool = True
+    ) -> list[Any]:
+        """Create an instance for each of the values which doesn't exist, and cache it in place of the error.
+
+        Each instance is validated with `full_clean()` first, and a value which can't be created
+        caches a ValidationError instead, for the rows which use it.
+
+        When committing, values cached as unsaved instances by an earlier call without `commit` are
+        created too.
+
+        @param build A callable which returns an unsaved instance for a value.
+        @param commit Save the instances (with bulk_create where possible), otherwise they're left unsaved.
+        @return The values which were (or would be) created.
+        """
+        missing = []
+        for value in values:
+            if value not in self:
+                try:
+                    self.__missing__(value)
+                except self.model.DoesNotExist:
+                    # It may not be cached, past `max_negative_entries`.
+                    missing.append(value)
+                    continue
+                except self.model.MultipleObjectsReturned:
+                    pass
+            cached = dict.get(self, value)
+            if isinstance(cached, self.model.DoesNotExist) or (
+                commit and self.is_unsaved(cached)
+            ):
+                missing.append(value)
+        if not missing:
+            return []
+
+        missing.sort(key=str)
+        instances = []
+        for value in missing[:]:
+            instance = build(value)
+            try:
+                instance.full_clean()
+            except ValidationError as err:
+                # Fail the rows which use the value, rather than the insert.
+                missing.remove(value)
+                self[value] = ValidationError(
+                    "Couldn't create %s '%s': %s"
+                    % (
+                        self.model._meta.verbose_name.title(),
+                        value,
+                        " ".join(err.messages),
+                    )
+                )
+                continue
+            instances.append(instance)
+        if commit and instances:
+            create_instances(self.model, instances)
+        for value, instance in zip(missing, instances):
+            self[value] = instance.pk if self.pk_only and commit else instance
+        return missing
+
+    def is_unsaved(self, value: Any) -> bool:
+        return isinstance(value, self.model) and value.pk is None
+
+    def discard_unsaved(self) -> None:
+        """Forget the unsaved instances cached by `create_missing`, so they're looked up (or created) again."""
+        for value in [
+            value for value, cached in self.items() if self.is_unsaved(cached)
+        ]:
+            dict.__delitem__(self, value)
+
+    def discard_errors(self) -> None:
+        """Forget the cached errors, e.g. values which didn't exist, so they're looked up again."""
+        for value in [
+            value for value, cached in self.items() if isinstance(cached, Exception)
+        ]:
+            dict.__delitem__(self, value)
+        self.negative_keys.clear()
+
+    def hydrate(self, pk: Any) -> T:
+        """Return an instance with just its primary key loaded, for a cache of `pk_only`."""
+        return self.model.from_db(self.queryset.db, [self.model._meta.pk.attname], [pk])
+
+    def prefetch(self, values: Iterable[Any], chunk_size: int = 500) -> None:
+        """Resolve any values not yet in the cache with one query per chunk, rather than one query per value.
+
+        The results (including DoesNotExist and MultipleObjectsReturned errors) are cached just as
+        `__missing__` would cache them.
+        """
+        if not self.prefetchable:
+            return
+        to_fields = list(self.to_field) if self.multifield else [self.to_field]
+        missing = {value for value in values if value not in self}
+        self.prefetched += len(missing)
+        # Keep the number of query parameters per chunk roughly constant for composite lookups.
+        for chunk in chunked(missing, max(chunk_size // len(to_fields), 1)):
+            self._prefetch_chunk(chunk, to_fields)
+
+    def _prefetch_chunk(self, chunk: list[Any], to_fields: list[str]) -> None:
+        if self.multifield:
+            query = reduce(
+                operator.or_, (Q(**dict(zip(to_fields, value))) for value in chunk)
+            )
+        else:
+            query = Q(**{f"{self.to_field}__in": chunk})
+
+        # Annotate the lookup values so each instance can be matched back to the value it was requested by.
+        aliases = {
+            f"_prefetch_key_{i}": F(to_field) for i, to_field in enumerate(to_fields)
+        }
+        matches = defaultdict(list)
+        queryset = self.queryset.filter(query).annotate(**aliases)
+        if self.pk_only:
+            for pk, *values in queryset.values_list("pk", *aliases):
+                matches[self._make_key(tuple(values))].append(pk)
+        else:
+            for inst in queryset:
+                key = self._make_key(tuple(getattr(inst, alias) for alias in aliases))
+                matches[key].append(inst)
+
+        requested = {self._make_lookup_key(value): value for value in chunk}
+        # If the database matched values differently to us (e.g. case insensitive collation or type coercion),
+        # we can't be sure a value is missing, so leave any unresolved values for `__missing__` to look up.
+        all_matched = requested.keys() >= matches.keys()
+
+        for key, value in requested.items():
+            found = matches.get(key, [])
+            if len(found) == 1:
+                self[value] = found[0]
+            elif len(found) > 1:
+                self[value] = self.model.MultipleObjectsReturned(
+                    "get() returned more than one %s -- it returned %s!"
+                    % (self.model._meta.object_name, len(found))
+                )
+            elif all_matched:
+                self[value] = self.model.DoesNotExist(
+                    "%s matching query does not exist." % self.model._meta.object_name
+                )
+
+    def _make_key(self, values: tuple[Any, ...]) -> str | tuple[str, ...]:
+        """Normalise the values of the `to_field`s, so they can be compared with the source data."""
+        if self.multifield:
+            return tuple(str(v) for v in values)
+        return str(values[0])
+
+    def _make_lookup_key(self, value: Any) -> str | tuple[str, ...]:
+        return self._make_key(value if self.multifield else (value,))
+
+
+class PreloadedInstanceLoader(CachedInstanceLoader):
+    """A cache which loads an index of every possible value once, so that lookups don't hit the database.
+
+    Only the primary keys are held in the index; instances are fetched (in bulk when prefetched) for the
+    values that are actually looked up. Duplicate values are detected when the index is loaded.
+
+    With `compact=True` the index is held as a sorted list of values and an array of primary keys, which
+    uses considerably less memory than a dict for very large tables, at the cost of a binary search per lookup.
+    """
+
+    def __init__(
+        self,
+        queryset: QuerySet[T],
+        to_field: str | Iterable[str],
+        compact: bool = False,
+        *args: Any,
+        **kwargs: Any,
+    ):
+        super().__init__(queryset, to_field, *args, **kwargs)
+        self.compact = compact
+        self.index = None
+        self.duplicates = None
+
+    def load(self) -> None:
+        to_fields = list(self.to_field) if self.multifield else [self.to_field]
+        rows = self.queryset.order_by().values_list("pk", *to_fields).iterator()
+        self.duplicates = {}
+
+        if self.compact:
+            entries = sorted((self._make_key(values), pk) for pk, *values in rows)
+            keys = []
+            pks = None
+            for key, pk in entries:
+                if keys and keys[-1] == key:
+                    self.duplicates[key] = self.duplicates.get(key, 1) + 1
+                    continue
+                if pks is None:
+                    pks = array("q") if isinstance(pk, int) else []
+                keys.append(key)
+                pks.append(pk)
+            self.index = (keys, pks or [])
+        else:
+            self.index = {}
+            for pk, *values in rows:
+                key = self._make_key(values)
+                if key in self.index:
+                    self.duplicates[key] = self.duplicates.get(key, 1) + 1
+                self.index[key] = pk
+
+    def get_pk(self, value: Any) -> Any:
+        """Return the primary key for a lookup value, raising DoesNotExist or MultipleObjectsReturned."""
+        if self.index is None:
+            self.load()
+
+        key = self._make_lookup_key(value)
+        if key in self.duplicates:
+            raise self.model.MultipleObjectsReturned(
+                "get() returned more than one %s -- it returned %s!"
+                % (self.model._meta.object_name, self.duplicates[key])
+            )
+
+        if self.compact:
+            keys, pks = self.index
+            pos = bisect_left(keys, key)
+            if pos < len(keys) and keys[pos] == key:
+                return pks[pos]
+        elif key in self.index:
+            return self.index[key]
+
+        raise self.model.DoesNotExist(
+            "%s matching query does not exist." % self.model._meta.object_name
+        )
+
+    def __missing__(self, value: str) -> T:
+        self.misses += 1
         try:
-            self[value] = inst = self.queryset.get(**params)
+            pk = self.get_pk(value)
+            # The index already has the primary key, so there's nothing to look up.
+            self[value] = inst = pk if self.pk_only else self.queryset.get(pk=pk)
         except self.model.DoesNotExist as err:
             self[value] = err  # Further warnings will be re-raised
             raise
@@ -49,3 +382,21 @@ class CachedInstanceLoader(dict):
             self[value] = err  # Further warnings will be re-raised
             raise
         return inst
+
+    def _prefetch_chunk(self, chunk: list[Any], to_fields: list[str]) -> None:
+        pks = {}
+        for value in chunk:
+            try:
+                pks[value] = self.get_pk(value)
+            except (self.model.DoesNotExist, self.model.MultipleObjectsReturned) as err:
+                self[value] = err
+
+        if self.pk_only:
+            for value, pk in pks.items():
+                self[value] = pk
+            return
+
+        instances = self.queryset.in_bulk(set(pks.values()))
+        for value, pk in pks.items():
+            if pk in instances:
+                self[value] = instances[pk]
@@ -2,13 +2,11 @@ from django.core.exceptions import ValidationError
 from django.forms import FileField
 
 from .fields import (
-    CachedChoiceField,
     FlatRelatedField,
     JSONField,
     SourceFieldSwitcher,
     UseCacheMixin,
 )
-from .loaders import CachedInstanceLoader
 from .widgets import CompositeLookupWidget, NamedSourceWidget
 
 """ These mixins hold all the code that relates to our special fields (flat related, json, cached choice)
@@ -18,15 +16,10 @@ that just doesn't work without access to the form instance. """
 class FlatRelatedFieldFormMixin:
     def __init__(self, data, *args, **kwargs):
         super().__init__(data, *args, **kwargs)
-        self.flat_related_mapping = {}
-        flat_related = {}
-
-        for field, fieldinstance in self.fields.items():
-            # For each FlatRelatedField, save a mapping back to the field.
-            if isinstance(fieldinstance, FlatRelatedField):
-                flat_related[field] = {}
-                for f in fieldinstance.fields.keys():
-                    self.flat_related_mapping[f] = field
+        plan = self.get_row_plan()
+        # For each FlatRelatedField, the plan holds a mapping back to the field.
+        self.flat_related_mapping = plan.flat_related_mapping
+        flat_related = {field: {} for field in plan.flat_related}
 
         # Tinker with data to combine flat fields into related objects.
         new_data = self.data.copy()
@@ -38,19 +31,25 @@ class FlatRelatedFieldFormMixin:
         self.flat_data = self.data
         self.data = new_data
 
+        # The related instances are only saved along with this form, once it's valid.
+        self.flat_related_instances = {}
+        self.flat_related_fields = {}
+        self.flat_related_created = set()
         for field, values in flat_related.items():
             mapped_values = dict(
-                (self.fields[field].fields[k]["to_field"], v) for k, v in values.items()
+                (plan.flat_related[field][k], v) for k, v in values.items()
             )
             # Get or create the related instance.
             if getattr(self.instance, field + "_id") is None:
                 instance = self.fields[field].model(**mapped_values)
+                self.flat_related_created.add(field)
             else:
                 instance = getattr(self.instance, field)
                 for attr, value in mapped_values.items():
                     setattr(instance, attr, value)
 
-            instance.save()  # NOTE: This gets fired during preview, but that's ok, since we wrap previews in a big rollback transaction.
+            self.flat_related_instances[field] = instance
+            self.flat_related_fields[field] = list(mapped_values)
             self.data[field] = instance
 
     def get_headers(self, given_headers=None):
@@ -88,48 +87,136 @@ class FlatRelatedFieldFormMixin:
                     )  # trying to access a field that doesn't exist on the model definition, should we check for the field in _meta.exclude?
         return instance_values
 
-    # TODO:
-    # def full_clean(self):
-    #     """ Validate that required fields in FlatRelated fields have been provided. """
-    #     super().full_clean()
-    #     for field, fieldinstance in self.fields.items():
-    #         if isinstance(fieldinstance, FlatRelatedField):
-    #             for f in fieldinstance.fields:
-    #                 import pdb; pdb.set_trace()
-    #                 pass
+    def _post_clean(self):
+        """Validate the related instances in memory, as they aren't saved until the form is."""
+        super()._post_clean()
+        plan = self.get_row_plan()
+        for field, instance in self.flat_related_instances.items():
+            columns = {
+                to_field: column
+                for column, to_field in plan.flat_related[field].items()
+            }
+            errors = []
+            missing = set()
+            for column, options in self.fields[field].fields.items():
+                if not options.get("required") or self.flat_data.get(column):
+                    continue
+                # Required columns must be given a value for new instances, and can't be blanked out.
+                if instance._state.adding or column in self.flat_data:
+                    errors.append(f"{column}: This field is required.")
+                    missing.add(options["to_field"])
+
+            # Only validate the fields which have been set from this row.
+            exclude = [
+                f.name
+                for f in instance._meta.fields
+                if f.name not in self.flat_related_fields[field] or f.name in missing
+            ]
+            try:
+                instance.full_clean(exclude=exclude)
+            except ValidationError as e:
+                for name, messages in e.message_dict.items():
+                    column = columns.get(name)
+                    errors.extend(
+                        f"{column}: {message}" if column else message
+                        for message in messages
+                    )
+
+            if errors:
+                self.add_error(field, errors)
+
+    def save(self, commit=True):
+        if commit:
+            self.save_flat_related()
+        return super().save(commit)
+
+    def save_flat_related(self):
+        for field, instance in self.flat_related_instances.items():
+            with self.profiler.phase("flat_related_save"):
+                instance.save()
+            # Point at the saved instance, in case it was given a new primary key.
+            setattr(self.instance, field, instance)
 
 
 class CachedChoiceFieldFormMixin:
     def __init__(self, data, *args, **kwargs):
         super().__init__(data, *args, **kwargs)
-        for field, fieldinstance in self.fields.items():
-            # For each CachedInstanceLoader, prime the cache.
-            if isinstance(fieldinstance, UseCacheMixin):
-                if field not in self.caches:
-                    self.caches[field] = CachedInstanceLoader(
-                        fieldinstance.queryset, fieldinstance.to_field
+        # Building the row plan primes the cache of each CachedInstanceLoader.
+        self.get_row_plan()
+
+    @staticmethod
+    def get_cache(caches, field, fieldinstance):
+        if field not in caches:
+            shared = getattr(caches, "shared", None)
+            caches[field] = (
+                shared.get_loader(fieldinstance)
+                if shared is not None
+                else fieldinstance.get_loader()
+            )
+        return caches[field]
+
+    @classmethod
+    def prefetch_caches(cls, caches, rows, chunk_size=500, commit=False):
+        """Collect the distinct lookup values in a batch of rows, and resolve them in bulk
+        so that cleaning each row doesn't need its own query. Lookups of the model being
+        imported are left to be made as each row is cleaned.
+
+        The loaders hold on to the values until they're released, once the batch has been processed.
+        The values which don't exist are created for fields with `create_missing`, although
+        they're left unsaved unless `commit` is true. Returns the created values of each field.
+        """
+        created = {}
+        for field, fieldinstance in cls.base_fields.items():
+            if not isinstance(fieldinstance, UseCacheMixin):
+                continue
+            if fieldinstance.queryset.model is cls._meta.model:
+                # Rows may refer to rows earlier in the batch, which haven't been saved yet.
+                continue
+            values = set()
+            for row in rows:
+                value = fieldinstance.widget.value_from_datadict(row, None, field)
+                if not value:
+                    continue
+                # Mirror CachedChoiceField.clean, which never looks these values up.
+                if any(not value[pos] for pos in fieldinstance.none_if_missing):
+                    continue
+                values.add(value)
+            if values:
+                loader = cls.get_cache(caches, field, fieldinstance)
+                # Keep every value of the batch cached until its rows have been processed.
+                loader.hold()
+                loader.prefetch(values, chunk_size)
+                if fieldinstance.create_missing:
+                    created[field] = loader.create_missing(
+                        values, fieldinstance.build_missing, commit
                     )
-                fieldinstance.set_cache(self.caches[field])
+        return created
 
     def _get_validation_exclusions(self):
         """We need to exclude any CachedChoiceFields from validation, as this
         causes a m * n queries where m is the number of relations, n is rows.
         """
         exclude = super()._get_validation_exclusions()
-        for field, fieldinstance in self.fields.items():
-            if isinstance(fieldinstance, CachedChoiceField):
-                exclude.add(field)
+        exclude.update(self.get_row_plan().validation_exclusions)
         return exclude
 
 
 class JSONFieldFormMixin:
     def _clean_fields(self):
+        json_columns = self.get_row_plan().json_columns or {}
         for name, field in self.fields.items():
             # value_from_datadict() gets the data from the data dictionaries.
             # Each widget type knows how to retrieve its own data, because some
             # widgets split data over several HTML fields.
             if field.disabled:
                 value = self.get_initial_for_field(field, name)
+            elif name in json_columns:
+                # The plan has already worked out which columns belong to the JSONField.
+                value = {
+                    key: self.data[column]
+                    for column, key in json_columns[name]
+                    if column in self.data
+                }
             else:
                 value = field.widget.value_from_datadict(
                     self.data, self.files, self.add_prefix(name)
@@ -155,9 +242,20 @@ class JSONFieldFormMixin:
 
 
 class SourceFieldSwitcherMixin:
+    # Set on the form classes built by the FormClassBuilder, which resolves the switchers once per import.
+    source_field_switchers_resolved = False
+
     def __init__(self, data, *args, **kwargs):
+        if not self.source_field_switchers_resolved:
+            self.resolve_source_field_switchers(data.keys())
+
+        super().__init__(data=data, *args, **kwargs)
+
+    @classmethod
+    def resolve_source_field_switchers(cls, headers):
         """Swap out all `SourceFieldSwitcher` fields for actual fields."""
-        for field_name, field_class in self.__class__.base_fields.items():
+        headers = set(headers)
+        for field_name, field_class in list(cls.base_fields.items()):
             if not isinstance(field_class, SourceFieldSwitcher):
                 continue
             for actual_field in field_class.fields:
@@ -167,8 +265,6 @@ class SourceFieldSwitcherMixin:
                     lookup = set(actual_field.widget.source)
                 else:
                     lookup = {field_name}
-                if lookup < set(data.keys()):
-                    self.base_fields[field_name] = actual_field
+                if lookup < headers:
+                    cls.base_fields[field_name] = actual_field
                     break
-
-        super().__init__(data=data, *args, **kwargs)
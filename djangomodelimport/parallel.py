@@ -0,0 +1,79 @@
+import threading
+
+import django
+from django.apps import apps
+
+from .caches import SimpleDictCache
+
+""" Worker side of ModelImporter.preview_parallel. These run in separate processes, so everything
+passed in and out of them has to be picklable. """
+
+# Lookup caches kept warm across the shards a worker previews, along with the preview they belong to.
+# They're kept per thread, in case the executor runs the shards in threads rather than processes.
+_worker = threading.local()
+
+
+def init_worker():
+    """Make sure Django is set up in a freshly spawned worker process."""
+    if not apps.ready:
+        django.setup()
+
+
+def pickle_queryset(queryset):
+    """Pickling a QuerySet evaluates it, so just send what's needed to rebuild it."""
+    if queryset is None:
+        return None
+    return (queryset.__class__, queryset.model, queryset.query)
+
+
+def unpickle_queryset(pickled):
+    if pickled is None:
+        return None
+    queryset_class, model, query = pickled
+    return queryset_class(model=model, query=query)
+
+
+def preview_shard(
+    preview_id, importer_class, modelimportformclass, headers, rows, start_line, kwargs
+):
+    """Preview a shard of rows, returning the results as plain tuples along with the counts.
+
+    Also returns the unique values and updated ids of the valid rows, for the duplicates across shards
+    to be found.
+    """
+    if getattr(_worker, "preview_id", None) != preview_id:
+        _worker.preview_id = preview_id
+        _worker.caches = SimpleDictCache()
+    caches = _worker.caches
+
+    kwargs = dict(
+        kwargs, limit_to_queryset=unpickle_queryset(kwargs.get("limit_to_queryset"))
+    )
+
+    importer = importer_class(modelimportformclass)
+    importresult = importer.process(
+        headers,
+        rows,
+        commit=False,
+        caches=caches,
+        start_line=start_line,
+        **kwargs,
+    )
+    results = [
+        (
+            result.linenumber,
+            result.row,
+            result.errors,
+            result.instance,
+            result.created,
+            result.warnings,
+        )
+        for result in importresult.get_results()
+    ]
+    seen = dict(importer.unique_index.seen) if importer.unique_index else {}
+    return (
+        results,
+        importresult.get_counts(),
+        importresult.get_created_lookups(),
+        (seen, importer.updated_lines),
+    )
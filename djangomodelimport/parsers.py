@@ -1,3 +1,8 @@
+import csv
+import datetime
+import io
+
+
 class BaseImportParser:
     def __init__(self, modelvalidator):
         """We provide the modelvalidator to get some Meta information about
@@ -25,6 +30,15 @@ class BaseImportParser:
                         header_map[renamefrom.lower()] = renameto.lower()
         return header_map
 
+    def normalise_headers(self, headers):
+        """Make all our headings lowercase and sub in soft headings."""
+        header_map = self.get_soft_headings()
+        normalised = []
+        for header in headers:
+            header_name = header.strip().lower()
+            normalised.append(header_map.get(header_name, header_name))
+        return normalised
+
     def parse(self, data):
         """Parsers should return a tuple containing (headings, data)
 
@@ -34,6 +48,33 @@ class BaseImportParser:
         raise NotImplementedError
 
 
+class CSVImportParser(BaseImportParser):
+    """Parses CSV data with the standard library csv reader.
+
+    Unlike the tablib parsers, the rows are returned as a generator which reads the data
+    lazily, so a file object can be imported without ever holding the whole file in memory.
+    """
+
+    def parse(self, data):
+        """@param data A string, or a file object opened in text mode (with newline="")."""
+        if isinstance(data, str):
+            data = io.StringIO(data)
+        reader = csv.reader(data)
+        headers = next(reader, [])
+        if headers:
+            headers[0] = headers[0].lstrip("\ufeff")  # Excel likes to add a BOM
+        headers = self.normalise_headers(headers)
+        return (headers, self._iter_rows(reader, headers))
+
+    def _iter_rows(self, reader, headers):
+        for values in reader:
+            if not values:
+                continue  # Skip blank lines
+            # Pad out short rows, so every header is present in every row
+            values += [""] * (len(headers) - len(values))
+            yield dict(zip(headers, values))
+
+
 class TablibBaseImportParser(BaseImportParser):
     def __init__(self, *args, **kwargs):
         # Inline import, so tablib is only grabbed if/when this Parser is instanciated.
@@ -47,27 +88,79 @@ class TablibCSVImportParser(TablibBaseImportParser):
     def parse(self, data):
         dataset = self.dataset_class()
         dataset.csv = data
+        dataset.headers = self.normalise_headers(dataset.headers)
+        return (dataset.headers, dataset.dict)
 
-        header_map = self.get_soft_headings()
 
-        # Make all our headings lowercase and sub in soft headings
-        for col_id, header in enumerate(
-            dataset.headers
-        ):  # replace it in headers if found
-            header_name = header.strip().lower()
-            dataset.headers[col_id] = header_name
-            if header_name in header_map.keys():
-                dataset.headers[col_id] = header_map[header_name]
+class XLSXImportParser(BaseImportParser):
+    """Parses the active worksheet of an Excel workbook.
 
-        return (dataset.headers, dataset.dict)
+    The workbook is opened in openpyxl's read-only mode and the rows are returned as a
+    generator, so large workbooks are streamed rather than loaded into memory. Cell values
+    are converted to strings, to match what the CSV parsers produce.
+
+    Requires openpyxl (e.g. `pip install tablib[xlsx]`).
+    """
 
+    def __init__(self, *args, **kwargs):
+        # Inline import, so openpyxl is only grabbed if/when this Parser is instanciated.
+        from openpyxl import load_workbook
+        from openpyxl.styles.numbers import is_datetime
+
+        self.load_workbook = load_workbook
+        self.is_datetime = is_datetime
+        super().__init__(*args, **kwargs)
 
-class TablibXLSXImportParser(TablibBaseImportParser):
     def parse(self, data):
-        dataset = self.dataset_class()
-        # TODO: This does not currently work, as dataset.xlsx cannot be set.
-        # http://docs.python-tablib.org/en/latest/api/#tablib.Dataset.xlsx
-        # We can wait for it to be supported, or in the meantime, use this converter:
-        # https://github.com/dilshod/xlsx2csv
-        dataset.xlsx = data  # CANNOT SET
-        return (dataset.headers, dataset.dict)
+        """@param data The contents of the workbook as bytes, or a file object opened in binary mode."""
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+        workbook = self.load_workbook(data, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows()
+
+        headers = [self.cell_to_string(cell) for cell in next(rows, ())]
+        while headers and not headers[-1]:
+            headers.pop()  # Drop any trailing empty columns
+        headers = self.normalise_headers(headers)
+        return (headers, self._iter_rows(workbook, rows, headers))
+
+    def _iter_rows(self, workbook, rows, headers):
+        try:
+            for cells in rows:
+                values = [self.cell_to_string(cell) for cell in cells[: len(headers)]]
+                if not any(values):
+                    continue  # Skip blank rows
+                # Pad out short rows, so every header is present in every row
+                values += [""] * (len(headers) - len(values))
+                yield dict(zip(headers, values))
+        finally:
+            # Read-only workbooks hold the file open until they're closed.
+            workbook.close()
+
+    def cell_to_string(self, cell):
+        value = cell.value
+        if (
+            isinstance(value, datetime.datetime)
+            and value.time() == datetime.time()
+            and self.is_datetime(cell.number_format) == "date"
+        ):
+            # Excel holds dates as datetimes, so write them as dates if that's how they're formatted.
+            return value.date().isoformat()
+        return self.to_string(value)
+
+    def to_string(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return str(value).lower()
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(sep=" ")
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return str(value)
+
+
+class TablibXLSXImportParser(XLSXImportParser):
+    """Kept for backwards compatibility, tablib can't load xlsx data. Use the XLSXImportParser."""
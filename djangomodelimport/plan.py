@@ -0,0 +1,120 @@
+import copy
+
+from .fields import (
+    CachedChoiceField,
+    DateTimeParserField,
+    FlatRelatedField,
+    JSONField,
+    UseCacheMixin,
+)
+from .magic import CachedChoiceFieldFormMixin
+from .widgets import JSONFieldWidget
+
+""" A row plan holds everything the importer form works out from its fields, so it can be worked out once
+per import rather than once per row. """
+
+
+class PlannedFields(dict):
+    """The fields of a row plan, which each form built from the plan copies.
+
+    Django deep copies a form's `base_fields` for every form instance, as a form may change its
+    fields (e.g. to apply `limit_choices_to` to a ModelChoiceField's queryset). The DateTimeParserFields
+    are shared rather than copied, so the format they infer and the values they parse are kept for
+    the whole import.
+    """
+
+    def __deepcopy__(self, memo):
+        return PlannedFields(
+            (
+                name,
+                (
+                    field
+                    if isinstance(field, DateTimeParserField)
+                    else copy.deepcopy(field, memo)
+                ),
+            )
+            for name, field in self.items()
+        )
+
+
+class ImportRowPlan:
+    """Everything the ImporterModelForm mixins need to know about the fields of a form.
+
+    Pass a plan to each form to skip inspecting the fields for every row. Each form still gets
+    its own copy of the fields (see PlannedFields), bound to the plan's caches.
+    """
+
+    def __init__(self, fields, caches, headers=None):
+        """
+        @param fields The form fields, already copied from the form class's `base_fields`.
+        @param caches The SimpleDictCache of lookups to bind the cached fields to.
+        @param headers The headers of the import, used to map the columns of JSONFields up front.
+        """
+        self.fields = fields
+        self.cached_fields = []
+        self.validation_exclusions = set()
+        # Maps each FlatRelatedField column to its field, and each field to its columns' `to_field`s.
+        self.flat_related_mapping = {}
+        self.flat_related = {}
+        # Maps each JSONField to its (column, key) pairs, if the headers are known.
+        self.json_columns = None if headers is None else {}
+        # Maps each column which can be parsed a column at a time (see `preparse`) to its field.
+        self.column_parsers = {}
+        # The UniquenessIndex the importer checks the rows with, if any (see `ImporterModelForm.validate_unique`).
+        self.unique_index = None
+
+        for field, fieldinstance in fields.items():
+            if isinstance(fieldinstance, UseCacheMixin):
+                self.cached_fields.append(field)
+                fieldinstance.set_cache(
+                    CachedChoiceFieldFormMixin.get_cache(caches, field, fieldinstance)
+                )
+            if isinstance(fieldinstance, CachedChoiceField):
+                self.validation_exclusions.add(field)
+            if isinstance(fieldinstance, FlatRelatedField):
+                # The related instance isn't saved until the form is, so it can't be validated by the model.
+                self.validation_exclusions.add(field)
+                self.flat_related[field] = {}
+                for column, options in fieldinstance.fields.items():
+                    self.flat_related_mapping[column] = field
+                    self.flat_related[field][column] = options["to_field"]
+            if (
+                isinstance(fieldinstance, JSONField)
+                and isinstance(fieldinstance.widget, JSONFieldWidget)
+                and headers is not None
+            ):
+                widget = fieldinstance.widget
+                self.json_columns[field] = (
+                    widget.columns
+                    if widget.columns is not None
+                    else widget.resolve_columns(field, headers)
+                )
+
+            if (
+                isinstance(fieldinstance, DateTimeParserField)
+                and headers is not None
+                and field in headers
+            ):
+                self.column_parsers[field] = fieldinstance
+
+    def preparse(self, rows):
+        """Return a copy of the rows, with the columns in `column_parsers` parsed a column at a time.
+
+        Values which can't be parsed are left as they are, for the form fields to deal with.
+        """
+        if not self.column_parsers:
+            return rows
+
+        rows = [dict(row) for row in rows]
+        for column, fieldinstance in self.column_parsers.items():
+            values = fieldinstance.parse_column(row.get(column) for row in rows)
+            for row, value in zip(rows, values):
+                row[column] = value
+        return rows
+
+    @classmethod
+    def for_form_class(cls, form_class, caches, headers=None):
+        """Build a plan for every form of an import, with its own copy of the form class's fields."""
+        return cls(
+            PlannedFields(copy.deepcopy(form_class.base_fields)), caches, headers
+        )
@@ -0,0 +1,122 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.db import connection
+
+from .loaders import CachedInstanceLoader
+
+""" Instrumentation for ModelImporter.process. A profiler is passed to `process`, which times each phase of
+processing a row, and counts the queries run during it. The aggregates end up on the ImportResultSet. """
+
+
+class ImportProfiler:
+    """Record the time spent, and the queries run, in each phase of an import.
+
+    The phases recorded by `ModelImporter.process` are:
+    - `prefetch`: resolving the cached lookups for a batch of rows (and creating any missing ones).
+    - `preparse`: parsing the date columns of a batch of rows (see `ImportRowPlan.preparse`).
+    - `update_lookup`: loading the instances to be updated by a batch of rows.
+    - `form_init`: constructing the form for a row.
+    - `is_valid`: validating a row.
+    - `unique_check`: checking the unique fields of a batch of rows, against each other and the database.
+    - `save`: saving a row (or a batch of rows, in bulk mode).
+    - `flat_related_save`: saving the related instances of FlatRelatedFields (within `save`).
+
+    Phases can be nested, in which case their times overlap, but each query is only counted
+    against the innermost phase.
+    """
+
+    def __init__(self, exporter=None):
+        """
+        @param exporter A callable which is passed the stats (see `get_stats`) at the end of each import,
+            e.g. to send them to a metrics backend.
+        """
+        self.exporter = exporter
+        self.phases = {}
+        self.caches = {}
+        # The counters of each loader at the start of the import, by id.
+        self.cache_baselines = {}
+        self.importer = None
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = {"count": 0, "time": 0.0, "queries": 0}
+
+        self._stack.append(stats)
+        start = time.perf_counter()
+        try:
+            if len(self._stack) == 1:
+                with connection.execute_wrapper(self._count_query):
+                    yield
+            else:
+                yield
+        finally:
+            stats["time"] += time.perf_counter() - start
+            stats["count"] += 1
+            self._stack.pop()
+
+    def _count_query(self, execute, sql, params, many, context):
+        self._stack[-1]["queries"] += 1
+        return execute(sql, params, many, context)
+
+    def start_caches(self, caches):
+        """Snapshot the counters of the loaders which already exist, i.e. those passed in or shared with
+        earlier imports, so that only the lookups made by this import are recorded."""
+        loaders = list(caches.values())
+        shared = getattr(caches, "shared", None)
+        if shared is not None:
+            loaders.extend(shared.loaders.values())
+        self.cache_baselines = {
+            id(loader): (loader.lookups, loader.misses, loader.prefetched)
+            for loader in loaders
+            if isinstance(loader, CachedInstanceLoader)
+        }
+
+    def record_caches(self, caches):
+        """Record the hits and misses of the cached lookups made since `start_caches`, keyed by field name."""
+        for field, loader in caches.items():
+            if isinstance(loader, CachedInstanceLoader):
+                lookups, misses, prefetched = self.cache_baselines.get(
+                    id(loader), (0, 0, 0)
+                )
+                self.caches[field] = {
+                    "hits": (loader.lookups - lookups) - (loader.misses - misses),
+                    "misses": loader.misses - misses,
+                    "prefetched": loader.prefetched - prefetched,
+                }
+
+    def get_stats(self):
+        return {
+            "importer": self.importer,
+            "phases": {name: dict(stats) for name, stats in self.phases.items()},
+            "caches": {field: dict(stats) for field, stats in self.caches.items()},
+            "queries": sum(stats["queries"] for stats in self.phases.values()),
+        }
+
+    def export(self):
+        if self.exporter:
+            self.exporter(self.get_stats())
+
+
+class NullProfiler:
+    """Used when an import isn't being profiled, so the instrumentation costs next to nothing."""
+
+    _phase = nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def start_caches(self, caches):
+        pass
+
+    def record_caches(self, caches):
+        pass
+
+    def get_stats(self):
+        return None
+
+    def export(self):
+        pass
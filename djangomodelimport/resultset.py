@@ -1,5 +1,22 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import weakref
+from bisect import bisect_left
+from operator import attrgetter
+
+
+def _page(items, offset, limit):
+    return items[offset:] if limit is None else items[offset : offset + limit]
+
+
 class ImportResultSet:
-    """Hold all imported results."""
+    """Hold all imported results.
+
+    Running counts, and indexes of the rows with errors and warnings, are kept as rows are appended,
+    so the errors and warnings can be counted and paged through without scanning every row.
+    """
 
     results = None
     headers = None
@@ -8,38 +25,86 @@ class ImportResultSet:
     updated = 0
     skipped = 0
     failed = 0
+    profile = None
+    # Set to False to drop the source row dicts of valid rows, to save memory on large imports.
+    keep_valid_row_data = True
 
     def __init__(self, headers, header_form):
         self.results = []
         self.headers = headers
         self.header_form = header_form
+        self.row_count = 0
+        self.error_count = 0
+        self.warning_count = 0
+        # Positions in `results` of the rows with errors / warnings.
+        self.error_index = []
+        self.warning_index = []
+        # The values created for each CachedChoiceField with `create_missing`.
+        self.created_lookups = {}
 
     def __repr__(self):
-        i = len(self.results)
-        j = len(self.get_errors())
-        k = len(self.get_warnings())
+        i = self.row_count
+        j = self.error_count
+        k = self.warning_count
         return f"ImportResultSet ({i} rows, {j} errors, {k} warnings)"
 
     def append(self, index, row, errors, instance, created, warnings=None):
+        valid = not errors
+        if valid and not self.keep_valid_row_data:
+            row = None
         result_row = ImportResultRow(
             self, index, row, errors, instance, created, warnings
         )
+        self._count(result_row)
+        if not valid:
+            self.error_index.append(len(self.results))
+        if result_row.warnings:
+            self.warning_index.append(len(self.results))
         self.results.append(result_row)
         return result_row
 
+    def _count(self, result_row):
+        self.row_count += 1
+        if not result_row.is_valid():
+            self.error_count += 1
+        if result_row.warnings:
+            self.warning_count += 1
+
     def get_import_headers(self):
         return self.header_form.get_headers(self.headers)
 
     def get_results(self):
         return self.results
 
+    def iter_results(self, offset=0, limit=None):
+        """Iterate over a page of the results."""
+        return iter(_page(self.results, offset, limit))
+
+    def get_result(self, linenumber):
+        """Return the result of a line, or None if it wasn't imported (e.g. it was skipped)."""
+        # Results are appended in line order.
+        i = bisect_left(self.results, linenumber, key=attrgetter("linenumber"))
+        if i < len(self.results) and self.results[i].linenumber == linenumber:
+            return self.results[i]
+        return None
+
     def get_errors(self):
-        return [
-            (row.linenumber, row.errors) for row in self.results if not row.is_valid()
-        ]
+        return list(self.iter_errors())
 
     def get_warnings(self):
-        return [(row.linenumber, row.warnings) for row in self.results if row.warnings]
+        return list(self.iter_warnings())
+
+    def iter_errors(self, offset=0, limit=None):
+        """Iterate over a page of (linenumber, errors) for the rows with errors."""
+        for i in _page(self.error_index, offset, limit):
+            row = self.results[i]
+            yield (row.linenumber, row.errors)
+
+    def iter_warnings(self, offset=0, limit=None):
+        """Iterate over a page of (linenumber, warnings) for the rows with warnings."""
+        for i in _page(self.warning_index, offset, limit):
+            row = self.results[i]
+            yield (row.linenumber, row.warnings)
 
     def set_counts(
         self, created=created, updated=updated, skipped=skipped, failed=failed
@@ -52,16 +117,199 @@ class ImportResultSet:
     def get_counts(self):
         return (self.created, self.updated, self.skipped, self.failed)
 
+    def add_created_lookups(self, field, values):
+        self.created_lookups.setdefault(field, []).extend(values)
+
+    def get_created_lookups(self):
+        """Return the values created for each field with `create_missing` (or which would be, in a preview)."""
+        return self.created_lookups
+
+    def set_profile(self, profile):
+        self.profile = profile
+
+    def get_profile(self):
+        """Return the stats recorded by the ImportProfiler passed to `process`, if any."""
+        return self.profile
+
+
+class StreamingImportResultSet(ImportResultSet):
+    """A result set which doesn't hold on to the imported rows, so memory use stays flat
+    no matter how large the import is.
+
+    Each row is handed to the `progress_logger` passed to `ModelImporter.process`, which acts
+    as the sink for the results. Only the counts, and the errors and warnings of the first
+    `max_errors` affected rows, are kept.
+    """
+
+    max_errors = 1000
+
+    def __init__(self, headers, header_form):
+        super().__init__(headers, header_form)
+        self.errors = []
+        self.warnings = []
+
+    def append(self, index, row, errors, instance, created, warnings=None):
+        result_row = ImportResultRow(
+            self, index, row, errors, instance, created, warnings
+        )
+        self._count(result_row)
+        if not result_row.is_valid() and len(self.errors) < self.max_errors:
+            self.errors.append((index, errors))
+        if result_row.warnings and len(self.warnings) < self.max_errors:
+            self.warnings.append((index, result_row.warnings))
+        return result_row
+
+    def get_result(self, linenumber):
+        return None
+
+    def get_errors(self):
+        return self.errors
+
+    def get_warnings(self):
+        return self.warnings
+
+    def iter_errors(self, offset=0, limit=None):
+        return iter(_page(self.errors, offset, limit))
+
+    def iter_warnings(self, offset=0, limit=None):
+        return iter(_page(self.warnings, offset, limit))
+
+
+class SQLiteImportResultSet(ImportResultSet):
+    """A result set which spills the results to an SQLite file, rather than holding them in memory.
+
+    Results are written in batches of `flush_size`, and indexed by line number and validity, so
+    pages of results, errors and warnings can be served quickly without loading the whole import.
+    The rows, errors and instances are pickled, so the results read back are copies.
+
+    The file is a temporary one, deleted when the result set is closed or garbage collected,
+    unless a `path` is set on a subclass.
+    """
+
+    path = None
+    flush_size = 1000
+
+    def __init__(self, headers, header_form):
+        super().__init__(headers, header_form)
+        path = self.path
+        temporary = path is None
+        if temporary:
+            fd, path = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(fd)
+        self.path = path
+        # The results may be read from a different thread to the import (e.g. in async views).
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            DROP TABLE IF EXISTS results;
+            CREATE TABLE results (
+                linenumber INTEGER PRIMARY KEY,
+                valid INTEGER NOT NULL,
+                has_warnings INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX results_valid ON results (valid, linenumber);
+            CREATE INDEX results_warnings ON results (has_warnings, linenumber);
+            """)
+        self.pending = []
+        self._finalizer = weakref.finalize(
+            self, _close_sqlite, self.connection, path if temporary else None
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the file, deleting it if it's a temporary one."""
+        self._finalizer()
+
+    def append(self, index, row, errors, instance, created, warnings=None):
+        if not errors and not self.keep_valid_row_data:
+            row = None
+        result_row = ImportResultRow(
+            self, index, row, errors, instance, created, warnings
+        )
+        self._count(result_row)
+        self.pending.append(
+            (
+                index,
+                result_row.is_valid(),
+                bool(result_row.warnings),
+                pickle.dumps((row, errors, instance, created, result_row.warnings)),
+            )
+        )
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+        return result_row
+
+    def flush(self):
+        """Write any buffered results to the file."""
+        if self.pending:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO results VALUES (?, ?, ?, ?)", self.pending
+                )
+            self.pending = []
+
+    def _select(self, where, offset, limit, params=()):
+        self.flush()
+        return self.connection.execute(
+            f"SELECT linenumber, data FROM results WHERE {where} "
+            "ORDER BY linenumber LIMIT ? OFFSET ?",
+            (*params, -1 if limit is None else limit, offset),
+        )
+
+    def _load(self, linenumber, data):
+        row, errors, instance, created, warnings = pickle.loads(data)
+        return ImportResultRow(
+            self, linenumber, row, errors, instance, created, warnings
+        )
+
+    def get_results(self):
+        return list(self.iter_results())
+
+    def iter_results(self, offset=0, limit=None):
+        for linenumber, data in self._select("1", offset, limit):
+            yield self._load(linenumber, data)
+
+    def get_result(self, linenumber):
+        for linenumber, data in self._select(
+            "linenumber = ?", 0, 1, params=(linenumber,)
+        ):
+            return self._load(linenumber, data)
+        return None
+
+    def iter_errors(self, offset=0, limit=None):
+        for linenumber, data in self._select("valid = 0", offset, limit):
+            result_row = self._load(linenumber, data)
+            yield (linenumber, result_row.errors)
+
+    def iter_warnings(self, offset=0, limit=None):
+        for linenumber, data in self._select("has_warnings = 1", offset, limit):
+            result_row = self._load(linenumber, data)
+            yield (linenumber, result_row.warnings)
+
+
+def _close_sqlite(connection, path):
+    connection.close()
+    if path is not None:
+        os.remove(path)
+
 
 class ImportResultRow:
     """Hold the result of an imported row."""
 
-    resultset = None
-    linenumber = None
-    row = None
-    errors = None
-    instance = None
-    created = None
+    __slots__ = (
+        "resultset",
+        "linenumber",
+        "row",
+        "errors",
+        "instance",
+        "created",
+        "warnings",
+    )
 
     def __init__(
         self, resultset, linenumber, row, errors, instance, created, warnings=None
@@ -78,7 +326,7 @@ class ImportResultRow:
         valid_str = "valid" if self.is_valid() else "invalid"
         mode_str = "create" if self.created else "update"
         res = self.get_instance_values() if self.is_valid() else self.errors
-        sample = str([(k, v) for k, v in self.row.items()])[:100]
+        sample = str([(k, v) for k, v in (self.row or {}).items()])[:100]
         return f"{self.linenumber}. [{valid_str}] [{mode_str}] ... {sample} ... {res}"
 
     def get_instance_values(self):
@@ -0,0 +1,83 @@
+from typing import TYPE_CHECKING, Callable
+
+from django.db import transaction
+
+if TYPE_CHECKING:
+    from .core import PendingRow  # NOQA
+
+""" Transaction strategies decide how the rows of an import are wrapped in savepoints when they are saved.
+
+Each strategy is given a list of valid rows, and a `write` callable which saves a list of rows (raising if
+any of them can't be saved). Any row which can't be saved should be marked with `pending_row.fail(err)`. """
+
+WriteRows = Callable[[list["PendingRow"]], None]
+
+
+class TransactionStrategy:
+    # If True, valid rows are held back and saved together at the end of each batch, rather than as
+    # soon as each row has been validated.
+    batched = False
+
+    def save(self, pending_rows: list["PendingRow"], write: WriteRows) -> None:
+        raise NotImplementedError
+
+
+class RowSavepointStrategy(TransactionStrategy):
+    """Save each row in its own savepoint, so a failing row is rolled back on its own."""
+
+    def save(self, pending_rows: list["PendingRow"], write: WriteRows) -> None:
+        for pending_row in pending_rows:
+            try:
+                with transaction.atomic():
+                    write([pending_row])
+            except Exception as err:
+                pending_row.fail(err)
+
+
+class ChunkSavepointStrategy(TransactionStrategy):
+    """Save each batch of rows in a single savepoint.
+
+    If the batch fails, it is split in half and each half is retried in its own savepoint, until the
+    failing rows are found. A batch with a single bad row costs about log2(batch_size) extra savepoints.
+    """
+
+    batched = True
+
+    def save(self, pending_rows: list["PendingRow"], write: WriteRows) -> None:
+        if not pending_rows:
+            return
+        try:
+            with transaction.atomic():
+                write(pending_rows)
+        except Exception as err:
+            if len(pending_rows) == 1:
+                pending_rows[0].fail(err)
+            else:
+                middle = len(pending_rows) // 2
+                self.save(pending_rows[:middle], write)
+                self.save(pending_rows[middle:], write)
+
+
+class SingleTransactionStrategy(TransactionStrategy):
+    """Save every row directly in the import's transaction, without any savepoints.
+
+    The first row which fails to save raises, which rolls back the whole import.
+    """
+
+    def save(self, pending_rows: list["PendingRow"], write: WriteRows) -> None:
+        write(pending_rows)
+
+
+class NoSavepointStrategy(TransactionStrategy):
+    """Save each row without a savepoint, recording any failure against the row.
+
+    This is only safe when saving doesn't write to the database (e.g. previews with `commit=False`),
+    as a failed query would otherwise leave the transaction unusable on some databases.
+    """
+
+    def save(self, pending_rows: list["PendingRow"], write: WriteRows) -> None:
+        for pending_row in pending_rows:
+            try:
+                write([pending_row])
+            except Exception as err:
+                pending_row.fail(err)
@@ -0,0 +1,176 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+import django
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.db import connection
+from django.db.models import Q
+from django.utils.text import capfirst, get_text_list
+
+""" Checks the unique fields of the rows of an import against each other, and against the database a batch
+at a time where the transaction strategy allows. """
+
+
+class UniquenessIndex:
+    """Remembers the unique values of every valid row of an import, to find the rows which clash with
+    each other, and checks the rows against the database in one query per unique check. The rows are
+    checked a batch at a time for batched transaction strategies, and one at a time otherwise.
+
+    Covers unique fields, `unique_together` and unconditional `UniqueConstraint`s. Use `for_model`,
+    which returns None for models with `unique_for_date` (etc) fields, which are left to Django.
+    """
+
+    def __init__(self, model, unique_checks):
+        """
+        @param model The model being imported.
+        @param unique_checks The (model_class, field names) pairs to check, as from `Model._get_unique_checks`.
+        """
+        self.model = model
+        self.unique_checks = unique_checks
+        # Maps each unique check to the values of the rows checked so far (less any which failed to save),
+        # and the line they were seen on.
+        self.seen = defaultdict(dict)
+
+    @classmethod
+    def for_model(cls, model):
+        # Before Django 4.1, the unique checks always included the Meta constraints.
+        kwargs = {"include_meta_constraints": True} if django.VERSION >= (4, 1) else {}
+        unique_checks, date_checks = model()._get_unique_checks(**kwargs)
+        if date_checks:
+            return None
+        return cls(model, unique_checks)
+
+    def get_key(self, instance, model_class, unique_check):
+        """Return the instance's values for the check, or None if any of them are blank (as Django does)."""
+        key = []
+        for field_name in unique_check:
+            field = model_class._meta.get_field(field_name)
+            value = getattr(instance, field.attname)
+            if value is None or (
+                value == "" and connection.features.interprets_empty_strings_as_nulls
+            ):
+                return None
+            key.append(value)
+        return tuple(key)
+
+    def check(self, pending_rows):
+        """Check the valid rows of a batch, failing any which clash with an earlier row or the database."""
+        rows = []
+        lookups = defaultdict(set)
+        for pending_row in pending_rows:
+            if not pending_row.form:
+                continue
+
+            instance = pending_row.form.instance
+            exclude = pending_row.form.get_unique_exclusions()
+            keys = []
+            for model_class, unique_check in self.unique_checks:
+                if any(field_name in exclude for field_name in unique_check):
+                    continue
+                key = self.get_key(instance, model_class, unique_check)
+                if key is None:
+                    continue
+                keys.append((model_class, unique_check, key))
+                lookups[model_class, unique_check].add(key)
+            rows.append((pending_row, keys))
+
+        existing = {
+            (model_class, unique_check): self.find_existing(
+                model_class, unique_check, keys
+            )
+            for (model_class, unique_check), keys in lookups.items()
+        }
+
+        for pending_row, keys in rows:
+            instance = pending_row.form.instance
+            errors = defaultdict(list)
+            for model_class, unique_check, key in keys:
+                field = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+                line = self.seen[model_class, unique_check].get(key)
+                pks = existing.get((model_class, unique_check), {}).get(key, set())
+                if line is not None:
+                    pending_row.duplicates.add(line)
+                    errors[field].append(
+                        self.duplicate_message(model_class, unique_check, line)
+                    )
+                elif pks - {instance._get_pk_val(model_class._meta)}:
+                    errors[field].extend(
+                        instance.unique_error_message(
+                            model_class, unique_check
+                        ).messages
+                    )
+
+            if errors:
+                pending_row.errors = list(errors.items())
+                pending_row.form = None
+            else:
+                pending_row.unique_keys = keys
+                for model_class, unique_check, key in keys:
+                    self.seen[model_class, unique_check][key] = pending_row.linenumber
+
+    def merge(self, seen, exclude=()):
+        """Check the values seen by another index (e.g. for a shard of a parallel preview) against this one's.
+
+        @param seen The other index's `seen` values, for lines which all come after this index's.
+        @param exclude Lines which have failed for another reason, so their values aren't recorded.
+        @return The errors of each line which repeats a value of an earlier line.
+        """
+        lines = defaultdict(list)
+        for (model_class, unique_check), values in seen.items():
+            for key, line in values.items():
+                lines[line].append((model_class, unique_check, key))
+
+        duplicates = {}
+        for line in sorted(lines):
+            errors = defaultdict(list)
+            for model_class, unique_check, key in lines[line]:
+                field = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+                seen_line = self.seen[model_class, unique_check].get(key)
+                if seen_line is not None:
+                    errors[field].append(
+                        self.duplicate_message(model_class, unique_check, seen_line)
+                    )
+            if errors:
+                duplicates[line] = list(errors.items())
+            elif line not in exclude:
+                for model_class, unique_check, key in lines[line]:
+                    self.seen[model_class, unique_check][key] = line
+        return duplicates
+
+    def forget(self, pending_row):
+        """Forget the values of a row which failed to save, so they don't clash with later rows."""
+        for model_class, unique_check, key in pending_row.unique_keys:
+            seen = self.seen[model_class, unique_check]
+            if seen.get(key) == pending_row.linenumber:
+                del seen[key]
+        pending_row.unique_keys = []
+
+    def find_existing(self, model_class, unique_check, keys):
+        """Return the primary keys of the rows in the database with each of the given values."""
+        attnames = [
+            model_class._meta.get_field(field_name).attname
+            for field_name in unique_check
+        ]
+        if len(attnames) == 1:
+            condition = Q(**{f"{attnames[0]}__in": [key[0] for key in keys]})
+        else:
+            condition = reduce(or_, (Q(**dict(zip(attnames, key))) for key in keys))
+
+        existing = defaultdict(set)
+        for pk, *key in model_class._default_manager.filter(condition).values_list(
+            "pk", *attnames
+        ):
+            existing[tuple(key)].add(pk)
+        return existing
+
+    def duplicate_message(self, model_class, unique_check, line):
+        opts = model_class._meta
+        field_labels = get_text_list(
+            [
+                capfirst(opts.get_field(field_name).verbose_name)
+                for field_name in unique_check
+            ],
+            "and",
+        )
+        return f"{capfirst(opts.verbose_name)} with this {field_labels} is already on line {line}."
@@ -1,8 +1,21 @@
 import dataclasses
-from typing import runtime_checkable, Protocol, Iterable
+import itertools
+from typing import (
+    runtime_checkable,
+    AsyncIterable,
+    Protocol,
+    Iterable,
+    Iterator,
+    TypeVar,
+)
 
+from asgiref.sync import async_to_sync
+
+from django.db import connections, router
 from django.forms import Field
 
+T = TypeVar("T")
+
 
 @runtime_checkable
 class HasSource(Protocol):
@@ -22,3 +35,49 @@ class ImportFieldMetadata:
     help_text: str = ""
     sources: list[list[tuple[str, str]]] = dataclasses.field(default_factory=list)
     required: bool = False
+
+
+def get_field_signature(form_class: type) -> tuple:
+    """Identifies the current set of fields on a form class, so that anything derived
+    from them can be cached, and invalidated if the fields are changed.
+    """
+    return tuple(form_class.base_fields.items())
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Yield successive lists of up to `size` items from any iterable, without materialising it."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def iter_async(iterable: AsyncIterable[T], size: int) -> Iterator[T]:
+    """Iterate over an async iterable from synchronous code running in a thread (i.e. under sync_to_async).
+
+    Items are read from the event loop `size` at a time, rather than one by one.
+    """
+    iterator = aiter(iterable)
+    read = async_to_sync(_read_chunk)
+    while chunk := read(iterator, size):
+        yield from chunk
+
+
+async def _read_chunk(iterator: AsyncIterable[T], size: int) -> list[T]:
+    chunk = []
+    async for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+def create_instances(model: type, instances: list) -> None:
+    """Insert new instances with bulk_create, or one at a time if the database can't return the
+    primary keys of a bulk insert (which are needed to point other rows at them)."""
+    if connections[
+        router.db_for_write(model)
+    ].features.can_return_rows_from_bulk_insert:
+        model._default_manager.bulk_create(instances)
+    else:
+        for instance in instances:
+            instance.save()
@@ -67,13 +67,28 @@ class NamedSourceWidget(forms.Widget):
 class JSONFieldWidget(forms.Widget):
     template_name = "django/forms/widgets/textarea.html"
 
+    # The (column, key) pairs of the field, if they've been resolved from the headers of the import.
+    columns = None
+
     def render(self, name, value, attrs=None, renderer=None):
         return ""
 
+    def resolve_columns(self, name, headers):
+        """Return the (column, key) pairs of the headers which belong to the field."""
+        return [
+            (header, header[len(name) + 1 :])
+            for header in headers
+            if header.startswith(name)
+        ]
+
     def value_omitted_from_data(self, data, files, name):
+        if self.columns is not None:
+            return not any(column in data for column, _ in self.columns)
         return not any([key.startswith(name) for key in data.keys()])
 
     def value_from_datadict(self, data, files, name):
+        if self.columns is not None:
+            return {key: data[column] for column, key in self.columns if column in data}
         extra_fields = {}
         for f in data.keys():
             if f.startswith(name):
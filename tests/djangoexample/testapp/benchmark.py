@@ -0,0 +1,278 @@
+import csv
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+from django.db import connection, connections, transaction
+
+import djangomodelimport
+
+from .importers import (
+    BookImporterWithCache,
+    CitationImporter,
+    CompanyImporter,
+    ReviewImporter,
+)
+from .models import Author, Book
+
+""" Benchmarks for the import pipeline, run with `python manage.py benchmark`.
+
+Each dataset is a synthetic CSV which exercises one or more of the import fields. The CSV is parsed,
+previewed and committed, recording the throughput, queries and peak RSS of each stage. """
+
+AUTHORS = 1000
+BOOKS_PER_AUTHOR = 5
+
+
+def write_books(writer, rng, rows, error_rate):
+    writer.writerow(["id", "name", "author"])
+    for i in range(rows):
+        writer.writerow(["", f"Book {i}", random_author(rng, error_rate)])
+
+
+def write_citations(writer, rng, rows, error_rate):
+    writer.writerow(["id", "name", "author", "metadata_isbn", "metadata_doi"])
+    for i in range(rows):
+        writer.writerow(
+            [
+                "",
+                f"Citation {i}",
+                random_author(rng, error_rate),
+                f"ISBN{rng.randrange(10**9):09}",
+                f"doi:{i}",
+            ]
+        )
+
+
+def write_companies(writer, rng, rows, error_rate):
+    writer.writerow(["id", "name", "contact_name", "email", "mobile", "address"])
+    for i in range(rows):
+        # A missing contact name fails validation
+        contact_name = "" if rng.random() < error_rate else f"Contact {i}"
+        writer.writerow(
+            [
+                "",
+                f"Company {i}",
+                contact_name,
+                f"contact{i}@example.com",
+                f"04{rng.randrange(10**8):08}",
+                f"{rng.randrange(1, 1000)} Example Street",
+            ]
+        )
+
+
+def write_reviews(writer, rng, rows, error_rate):
+    writer.writerow(
+        [
+            "id",
+            "book_author",
+            "book",
+            "author",
+            "contact_name",
+            "email",
+            "mobile",
+            "address",
+            "reviewed_at",
+            "metadata_rating",
+            "metadata_source",
+        ]
+    )
+    for i in range(rows):
+        book_author = rng.randrange(AUTHORS)
+        writer.writerow(
+            [
+                "",
+                f"Author {book_author}",
+                f"Book {book_author}-{rng.randrange(BOOKS_PER_AUTHOR)}",
+                random_author(rng, error_rate),
+                f"Reviewer {i}",
+                f"reviewer{i}@example.com",
+                f"04{rng.randrange(10**8):08}",
+                f"{rng.randrange(1, 1000)} Example Street",
+                f"{rng.randrange(1, 29)}/{rng.randrange(1, 13)}/20{rng.randrange(10, 25)} "
+                f"{rng.randrange(24):02}:{rng.randrange(60):02}",
+                str(rng.randrange(1, 6)),
+                rng.choice(["web", "print", "radio"]),
+            ]
+        )
+
+
+def random_author(rng, error_rate):
+    if rng.random() < error_rate:
+        return "Nobody"  # Doesn't exist, so the row fails validation
+    return f"Author {rng.randrange(AUTHORS)}"
+
+
+# The importer for each dataset, and the function which writes its CSV.
+DATASETS = {
+    "books": (BookImporterWithCache, write_books),
+    "citations": (CitationImporter, write_citations),
+    "companies": (CompanyImporter, write_companies),
+    "reviews": (ReviewImporter, write_reviews),
+}
+
+
+def create_fixtures():
+    """Create the authors and books which the datasets look up."""
+    authors = Author.objects.bulk_create(
+        Author(name=f"Author {i}") for i in range(AUTHORS)
+    )
+    Book.objects.bulk_create(
+        Book(name=f"Book {i}-{j}", author=author)
+        for i, author in enumerate(authors)
+        for j in range(BOOKS_PER_AUTHOR)
+    )
+
+
+def generate_csv(path, dataset, rows, seed=0, error_rate=0.01):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as fh:
+        DATASETS[dataset][1](csv.writer(fh), rng, rows, error_rate)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure_peak_rss(func):
+    """Run a stage in a forked process, returning that process's peak RSS in KiB.
+
+    The benchmark process's own peak RSS never goes down, so it would only report the largest stage
+    run so far. Any changes the stage makes to the database are rolled back.
+    """
+    # The child mustn't share the parent's database connections.
+    connections.close_all()
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+
+    def run():
+        try:
+            with transaction.atomic():
+                func()
+                transaction.set_rollback(True)
+        finally:
+            sender.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    process = multiprocessing.get_context("fork").Process(target=run)
+    process.start()
+    sender.close()
+    try:
+        peak = receiver.recv()
+    finally:
+        process.join()
+    # ru_maxrss is in bytes on macOS, and KiB elsewhere.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure(stage, dataset, rows, func):
+    """Run one stage of the benchmark, returning its result.
+
+    The stage is run twice: first in a separate process for its peak RSS, then timed in this one.
+    """
+    peak_rss_kb = measure_peak_rss(func)
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        extra = func()
+        seconds = time.perf_counter() - start
+
+    return dict(
+        dataset=dataset,
+        stage=stage,
+        rows=rows,
+        seconds=round(seconds, 4),
+        rows_per_sec=round(rows / seconds, 1) if seconds else None,
+        queries=counter.count,
+        peak_rss_kb=peak_rss_kb,
+        **extra,
+    )
+
+
+def run_dataset(path, dataset, rows, bulk=False, batch_size=500):
+    importer_class = DATASETS[dataset][0]
+    results = []
+
+    def parse():
+        with open(path, newline="") as fh:
+            headers, parsed = djangomodelimport.CSVImportParser(importer_class).parse(
+                fh
+            )
+            for _ in parsed:
+                pass
+        return {}
+
+    def process(commit):
+        profiler = djangomodelimport.ImportProfiler()
+        with open(path, newline="") as fh:
+            headers, parsed = djangomodelimport.CSVImportParser(importer_class).parse(
+                fh
+            )
+            importresult = djangomodelimport.ModelImporter(importer_class).process(
+                headers,
+                parsed,
+                commit=commit,
+                bulk=bulk,
+                batch_size=batch_size,
+                resultset_cls=djangomodelimport.StreamingImportResultSet,
+                profiler=profiler,
+            )
+        created, updated, skipped, failed = importresult.get_counts()
+        return dict(
+            created=created,
+            failed=failed,
+            profile=importresult.get_profile()["phases"],
+        )
+
+    results.append(measure("parse", dataset, rows, parse))
+    results.append(measure("preview", dataset, rows, lambda: process(False)))
+    results.append(measure("commit", dataset, rows, lambda: process(True)))
+    return results
+
+
+def run_benchmarks(
+    directory, datasets=None, rows=10000, bulk=False, batch_size=500, seed=0
+):
+    """Generate and import each dataset, returning a report of the results.
+
+    Expects an empty database, which the fixtures are created in.
+    """
+    create_fixtures()
+
+    results = []
+    for dataset in datasets or DATASETS:
+        path = os.path.join(directory, f"{dataset}.csv")
+        generate_csv(path, dataset, rows, seed=seed)
+        results.extend(run_dataset(path, dataset, rows, bulk, batch_size))
+
+    return dict(
+        version=djangomodelimport.__version__,
+        python=sys.version.split()[0],
+        database=connection.vendor,
+        rows=rows,
+        bulk=bulk,
+        batch_size=batch_size,
+        seed=seed,
+        results=results,
+    )
+
+
+def compare(report, previous):
+    """Return the relative change in rows/sec for each stage, against a previous report."""
+    before = {
+        (result["dataset"], result["stage"]): result["rows_per_sec"]
+        for result in previous["results"]
+    }
+    changes = {}
+    for result in report["results"]:
+        key = (result["dataset"], result["stage"])
+        if before.get(key) and result["rows_per_sec"]:
+            changes[key] = result["rows_per_sec"] / before[key] - 1
+    return changes
@@ -2,7 +2,16 @@ from django import forms
 
 import djangomodelimport
 
-from .models import Author, Book, Citation, Company, Contact
+from .models import (
+    Author,
+    Book,
+    Citation,
+    Company,
+    Contact,
+    Edition,
+    Review,
+    Site,
+)
 
 
 class BookImporter(djangomodelimport.ImporterModelForm):
@@ -31,6 +40,20 @@ class BookImporterWithCache(djangomodelimport.ImporterModelForm):
         )
 
 
+class BookImporterWithPreload(djangomodelimport.ImporterModelForm):
+    name = forms.CharField()
+    author = djangomodelimport.PreloadedChoiceField(
+        queryset=Author.objects.all(), to_field="name"
+    )
+
+    class Meta:
+        model = Book
+        fields = (
+            "name",
+            "author",
+        )
+
+
 class CitationImporter(djangomodelimport.ImporterModelForm):
     name = forms.CharField()
     author = djangomodelimport.CachedChoiceField(
@@ -64,3 +87,110 @@ class CompanyImporter(djangomodelimport.ImporterModelForm):
             "name",
             "primary_contact",
         )
+
+
+class ReviewImporter(djangomodelimport.ImporterModelForm):
+    book = djangomodelimport.CachedChoiceField(
+        queryset=Book.objects.all(),
+        to_field=("author__name", "name"),
+        widget=djangomodelimport.CompositeLookupWidget(source=("book_author", "book")),
+    )
+    author = djangomodelimport.CachedChoiceField(
+        queryset=Author.objects.all(), to_field="name"
+    )
+    contact = djangomodelimport.FlatRelatedField(
+        queryset=Contact.objects.all(),
+        fields={
+            "contact_name": {"to_field": "name", "required": True},
+            "email": {"to_field": "email"},
+            "mobile": {"to_field": "mobile"},
+            "address": {"to_field": "address"},
+        },
+    )
+    reviewed_at = djangomodelimport.DateTimeParserField()
+    metadata = djangomodelimport.JSONField()
+
+    class Meta:
+        model = Review
+        fields = (
+            "book",
+            "author",
+            "contact",
+            "reviewed_at",
+            "metadata",
+        )
+
+
+class BookImporterWithSwitcher(djangomodelimport.ImporterModelForm):
+    name = forms.CharField()
+    author = djangomodelimport.SourceFieldSwitcher(
+        djangomodelimport.CachedChoiceField(
+            queryset=Author.objects.all(), to_field="name"
+        ),
+        djangomodelimport.CachedChoiceField(
+            queryset=Author.objects.all(),
+            to_field="id",
+            widget=djangomodelimport.NamedSourceWidget(source="author_id"),
+        ),
+    )
+
+    class Meta:
+        model = Book
+        fields = (
+            "name",
+            "author",
+        )
+
+
+class EditionImporter(djangomodelimport.ImporterModelForm):
+    book = djangomodelimport.CachedChoiceField(
+        queryset=Book.objects.all(), to_field="name"
+    )
+
+    class Meta:
+        model = Edition
+        fields = (
+            "book",
+            "number",
+            "isbn",
+        )
+
+
+class BookImporterCreatingAuthors(djangomodelimport.ImporterModelForm):
+    name = forms.CharField()
+    author = djangomodelimport.CachedChoiceField(
+        queryset=Author.objects.all(), to_field="name", create_missing=True
+    )
+
+    class Meta:
+        model = Book
+        fields = (
+            "name",
+            "author",
+        )
+
+
+class SiteImporter(djangomodelimport.ImporterModelForm):
+    parent = forms.ModelChoiceField(
+        queryset=Site.objects.all(), to_field_name="ref", required=False
+    )
+
+    class Meta:
+        model = Site
+        fields = (
+            "ref",
+            "parent",
+        )
+
+
+class SiteImporterWithCache(djangomodelimport.ImporterModelForm):
+    parent = djangomodelimport.CachedChoiceField(
+        queryset=Site.objects.all(), to_field="ref", required=False
+    )
+
+    class Meta:
+        model = Site
+        fields = (
+            "ref",
+            "parent",
+        )
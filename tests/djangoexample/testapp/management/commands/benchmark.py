@@ -0,0 +1,68 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from testapp.benchmark import DATASETS, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark parsing, previewing and committing synthetic CSVs, in a fresh test database. "
+        "Set DATABASE_ENGINE=postgresql to run against PostgreSQL (see settings.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=10000, help="The number of rows per dataset."
+        )
+        parser.add_argument(
+            "--dataset",
+            action="append",
+            choices=sorted(DATASETS),
+            help="The datasets to run (defaults to all of them).",
+        )
+        parser.add_argument("--bulk", action="store_true", help="Commit in bulk mode.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output", help="Where to write the JSON report (defaults to stdout)."
+        )
+        parser.add_argument(
+            "--compare", help="A previous JSON report to compare rows/sec against."
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                report = run_benchmarks(
+                    directory,
+                    datasets=options["dataset"],
+                    rows=options["rows"],
+                    bulk=options["bulk"],
+                    batch_size=options["batch_size"],
+                    seed=options["seed"],
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for result in report["results"]:
+            self.stderr.write(
+                "{dataset:>10} {stage:>8}: {rows_per_sec:>10} rows/sec, "
+                "{queries:>8} queries, {peak_rss_kb} KiB peak RSS".format(**result)
+            )
+
+        if options["compare"]:
+            with open(options["compare"]) as fh:
+                changes = compare(report, json.load(fh))
+            for (dataset, stage), change in changes.items():
+                self.stderr.write(f"{dataset:>10} {stage:>8}: {change:+.1%}")
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(output)
+        else:
+            self.stdout.write(output)
@@ -47,3 +47,40 @@ class Company(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class Review(models.Model):
+    """Exercises all of the import fields at once, for the benchmarks."""
+
+    book = models.ForeignKey(Book, on_delete=models.PROTECT)
+    author = models.ForeignKey(Author, on_delete=models.PROTECT)
+    contact = models.ForeignKey(Contact, on_delete=models.PROTECT)
+    reviewed_at = models.DateTimeField()
+    metadata = JSONField()
+
+    def __str__(self):
+        return f"{self.book} ({self.author})"
+
+
+class Edition(models.Model):
+    """Has unique fields, for the uniqueness checks."""
+
+    book = models.ForeignKey(Book, on_delete=models.PROTECT)
+    number = models.PositiveIntegerField()
+    isbn = models.CharField(max_length=13, unique=True)
+
+    class Meta:
+        unique_together = [("book", "number")]
+
+    def __str__(self):
+        return f"{self.book} #{self.number}"
+
+
+class Site(models.Model):
+    """Refers to other sites, for rows which depend on rows earlier in the same file."""
+
+    ref = models.CharField(max_length=20)
+    parent = models.ForeignKey("self", null=True, blank=True, on_delete=models.PROTECT)
+
+    def __str__(self):
+        return self.ref
@@ -1,16 +1,68 @@
+import asyncio
+import copy
 import datetime
-
+import io
+import os
+import pickle
+import tempfile
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from unittest import mock
+
+from testapp.benchmark import measure, run_benchmarks
 from testapp.importers import (
     BookImporter,
+    BookImporterCreatingAuthors,
     BookImporterWithCache,
+    BookImporterWithPreload,
+    BookImporterWithSwitcher,
     CitationImporter,
     CompanyImporter,
+    EditionImporter,
+    ReviewImporter,
+    SiteImporter,
+    SiteImporterWithCache,
+)
+from testapp.models import (
+    Author,
+    Book,
+    Citation,
+    Company,
+    Contact,
+    Edition,
+    Review,
+    Site,
 )
-from testapp.models import Author, Book, Citation, Company, Contact
-
-from django.test import TestCase
 
-from djangomodelimport import DateTimeParserField, ModelImporter, TablibCSVImportParser
+from django import forms
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from djangomodelimport import (
+    CachedChoiceField,
+    ChunkSavepointStrategy,
+    CSVImportParser,
+    DateTimeParserField,
+    FileCheckpointStore,
+    ImportProfiler,
+    ImportResultRow,
+    ImportResultSet,
+    ModelImporter,
+    NoSavepointStrategy,
+    RowSavepointStrategy,
+    SharedLookupCache,
+    SingleTransactionStrategy,
+    SQLiteImportResultSet,
+    SourceFieldSwitcher,
+    StreamingImportResultSet,
+    TablibCSVImportParser,
+    XLSXImportParser,
+)
+from djangomodelimport.formclassbuilder import FormClassBuilder
+from djangomodelimport.loaders import CachedInstanceLoader, PreloadedInstanceLoader
+from djangomodelimport.plan import ImportRowPlan
+from djangomodelimport.uniqueness import UniquenessIndex
 
 sample_csv_1_books = """id,name,author
 ,How to be awesome,Aidan Lister
@@ -213,22 +265,18 @@ class CachedChoiceFieldTests(TestCase):
 
         importer = ModelImporter(BookImporterWithCache)
 
-        # Check for only two queries (one to look up Bill, another to look up Aidan Lister)
+        # Check for only one lookup query (both authors are resolved together)
         # Expected query log:
         # SAVEPOINT "s140735624082240_x2"
         # SAVEPOINT "s140735624082240_x3"
-        # SELECT "testapp_author"."id", "testapp_author"."name" FROM "testapp_author" WHERE "testapp_author"."name" = 'Aidan Lister'
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be awesome', 2)
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be really awesome', 2)
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be the best', 2)
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be great', 2)
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be so good', 2)
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be better than that', 2)
-        # SELECT "testapp_author"."id", "testapp_author"."name" FROM "testapp_author" WHERE "testapp_author"."name" = 'Bill'
-        # INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How not to be awesome', 3)
+        # SELECT "testapp_author"."id", "testapp_author"."name", ... WHERE "testapp_author"."name" IN ('Aidan Lister', 'Bill')
+        # Then for each of the 7 rows:
+        #   SAVEPOINT "s140735624082240_x4"
+        #   INSERT INTO "testapp_book" ("name", "author_id") VALUES ('How to be awesome', 2)
+        #   RELEASE SAVEPOINT "s140735624082240_x4"
         # RELEASE SAVEPOINT "s140735624082240_x3"
         # RELEASE SAVEPOINT "s140735624082240_x2"
-        with self.assertNumQueries(13):
+        with self.assertNumQueries(26):
             importresult = importer.process(headers, rows, commit=True)
 
         res = importresult.get_results()
@@ -410,3 +458,1684 @@ class DateTimeParserFieldTests(TestCase):
             self.medtf.to_python("2018-02-12 17:06:46"),
             datetime.datetime(2018, 2, 12, 17, 6, 46),
         )
+
+
+class BulkImportTests(TestCase):
+    def test_bulk_create_and_update(self):
+        a1 = Author.objects.create(name="Aidan Lister")
+        Author.objects.create(name="Bill")
+        b1 = Book.objects.create(name="Hello", author=a1)
+
+        rows = [
+            {"id": "", "name": "How to be awesome", "author": "Aidan Lister"},
+            {"id": str(b1.id), "name": "How to be fine", "author": "Bill"},
+            {"id": "", "name": "How not to be awesome", "author": "Nobody"},
+            {"id": "", "name": "How to be the best", "author": "Bill"},
+        ]
+
+        importer = ModelImporter(BookImporterWithCache)
+        importresult = importer.process(
+            ["id", "name", "author"], rows, commit=True, bulk=True, batch_size=2
+        )
+
+        # Only the invalid row is reported, and results stay in line order
+        errors = importresult.get_errors()
+        self.assertEqual([linenumber for linenumber, _ in errors], [3])
+        res = importresult.get_results()
+        self.assertEqual([r.linenumber for r in res], [1, 2, 3, 4])
+        self.assertIsNotNone(res[0].instance.pk)
+        self.assertEqual(importresult.get_counts(), (2, 1, 0, 1))
+
+        b1.refresh_from_db()
+        self.assertEqual(b1.name, "How to be fine")
+        self.assertEqual(b1.author.name, "Bill")
+        self.assertEqual(Book.objects.count(), 3)
+
+    def test_failed_batch_falls_back_to_row_by_row(self):
+        Author.objects.create(name="Aidan Lister")
+
+        parser = TablibCSVImportParser(BookImporterWithCache)
+        headers, rows = parser.parse(sample_csv_5_books.replace("Bill", "Aidan Lister"))
+
+        original_save = Book.save
+
+        def save(book, *args, **kwargs):
+            if book.name == "How to be great":
+                raise ValueError("Cannot save this one")
+            return original_save(book, *args, **kwargs)
+
+        importer = ModelImporter(BookImporterWithCache)
+        with mock.patch.object(
+            type(Book.objects), "bulk_create", side_effect=ValueError("Batch failed")
+        ), mock.patch.object(Book, "save", save):
+            importresult = importer.process(headers, rows, commit=True, bulk=True)
+
+        errors = importresult.get_errors()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 4)
+        self.assertEqual(Book.objects.count(), 6)
+
+    def test_bulk_create_without_returned_pks(self):
+        Author.objects.create(name="Aidan Lister")
+
+        parser = TablibCSVImportParser(BookImporterWithCache)
+        headers, rows = parser.parse(sample_csv_5_books.replace("Bill", "Aidan Lister"))
+
+        # Databases that can't return the new primary keys have the rows saved one at a time
+        importer = ModelImporter(BookImporterWithCache)
+        with mock.patch.object(
+            type(connection.features), "can_return_rows_from_bulk_insert", False
+        ):
+            importresult = importer.process(headers, rows, commit=True, bulk=True)
+
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(importresult.get_counts(), (7, 0, 0, 0))
+        self.assertTrue(all(r.instance.pk for r in importresult.get_results()))
+        self.assertEqual(Book.objects.count(), 7)
+
+
+class CachedInstanceLoaderTests(TestCase):
+    def test_prefetch(self):
+        Author.objects.create(name="Aidan Lister")
+        Author.objects.create(name="Bill")
+        Author.objects.create(name="Bill")
+
+        loader = CachedInstanceLoader(Author.objects.all(), "name")
+        with self.assertNumQueries(1):
+            loader.prefetch(["Aidan Lister", "Bill", "Nobody"])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(loader["Aidan Lister"].name, "Aidan Lister")
+            with self.assertRaises(Author.MultipleObjectsReturned):
+                loader["Bill"]
+            with self.assertRaises(Author.DoesNotExist):
+                loader["Nobody"]
+
+    def test_prefetch_lookup(self):
+        author = Author.objects.create(name="Aidan Lister")
+        loader = CachedInstanceLoader(Author.objects.all(), "name__iexact")
+
+        # The values can't be matched back to the results, so they're looked up one at a time
+        with self.assertNumQueries(0):
+            loader.prefetch(["aidan lister"])
+        with self.assertNumQueries(1):
+            self.assertEqual(loader["aidan lister"], author)
+
+        class BookImporterWithLookup(BookImporterWithCache):
+            author = CachedChoiceField(
+                queryset=Author.objects.all(), to_field="name__iexact"
+            )
+
+        importresult = ModelImporter(BookImporterWithLookup).process(
+            ["id", "name", "author"],
+            [{"id": "", "name": "Starburst", "author": "AIDAN LISTER"}],
+            commit=True,
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(Book.objects.get(name="Starburst").author, author)
+
+    def test_prefetch_composite(self):
+        a1 = Author.objects.create(name="Aidan Lister")
+        a2 = Author.objects.create(name="Bill")
+        Book.objects.create(name="Hello", author=a1)
+        Book.objects.create(name="Hello", author=a2)
+
+        loader = CachedInstanceLoader(Book.objects.all(), ("name", "author__name"))
+        with self.assertNumQueries(1):
+            loader.prefetch([("Hello", "Bill"), ("Hello", "Nobody")])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(loader[("Hello", "Bill")].author_id, a2.id)
+            with self.assertRaises(Book.DoesNotExist):
+                loader[("Hello", "Nobody")]
+
+
+class PreloadedChoiceFieldTests(TestCase):
+    def test_import(self):
+        Author.objects.create(name="Aidan Lister")
+        Author.objects.create(name="Bill")
+        Author.objects.create(name="Unused")
+
+        parser = TablibCSVImportParser(BookImporterWithPreload)
+        headers, rows = parser.parse(sample_csv_5_books + ",Who wrote this,Nobody\n")
+
+        importer = ModelImporter(BookImporterWithPreload)
+        importresult = importer.process(headers, rows, commit=True)
+
+        errors = importresult.get_errors()
+        self.assertEqual(
+            errors, [(8, [("author", ["No Author matching 'Nobody'."])])]
+        )
+        res = importresult.get_results()
+        self.assertEqual(res[0].instance.author.name, "Aidan Lister")
+        self.assertEqual(res[6].instance.author.name, "Bill")
+
+    def test_index(self):
+        a1 = Author.objects.create(name="Aidan Lister")
+        Author.objects.create(name="Bill")
+        Author.objects.create(name="Bill")
+
+        for compact in (False, True):
+            loader = PreloadedInstanceLoader(Author.objects.all(), "name", compact)
+
+            # One query to load the index, and one to fetch the referenced instances
+            with self.assertNumQueries(2):
+                loader.prefetch(["Aidan Lister", "Bill", "Nobody"])
+
+            with self.assertNumQueries(0):
+                self.assertEqual(loader["Aidan Lister"], a1)
+                with self.assertRaisesMessage(
+                    Author.MultipleObjectsReturned, "it returned 2!"
+                ):
+                    loader["Bill"]
+                with self.assertRaises(Author.DoesNotExist):
+                    loader["Nobody"]
+
+
+class StreamingImportTests(TestCase):
+    def test_csv_parser(self):
+        parser = CSVImportParser(BookImporter)
+        headers, rows = parser.parse(io.StringIO("\ufeffID, Name ,Author\n,Hello\n\n,Goodbye,Bill\n"))
+
+        self.assertEqual(headers, ["id", "name", "author"])
+        self.assertNotIsInstance(rows, list)
+        self.assertEqual(
+            list(rows),
+            [
+                {"id": "", "name": "Hello", "author": ""},
+                {"id": "", "name": "Goodbye", "author": "Bill"},
+            ],
+        )
+
+    def test_xlsx_parser(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(["ID", " Name ", "Author", "Published", None])
+        sheet.append(
+            [None, "Hello", "Aidan Lister", datetime.datetime(2020, 1, 2, 3, 4)]
+        )
+        sheet.append([])
+        sheet.append([12.0, "Goodbye"])
+        # Date cells are read back as midnight datetimes
+        sheet.append([13.0, "Hello again", None, datetime.date(2024, 3, 1)])
+        sheet.append([14.0, "Midnight", None, datetime.datetime(2024, 3, 1)])
+        data = io.BytesIO()
+        workbook.save(data)
+
+        parser = XLSXImportParser(BookImporter)
+        headers, rows = parser.parse(data.getvalue())
+
+        self.assertEqual(headers, ["id", "name", "author", "published"])
+        self.assertNotIsInstance(rows, list)
+        self.assertEqual(
+            list(rows),
+            [
+                {
+                    "id": "",
+                    "name": "Hello",
+                    "author": "Aidan Lister",
+                    "published": "2020-01-02 03:04:00",
+                },
+                {"id": "12", "name": "Goodbye", "author": "", "published": ""},
+                {
+                    "id": "13",
+                    "name": "Hello again",
+                    "author": "",
+                    "published": "2024-03-01",
+                },
+                {
+                    "id": "14",
+                    "name": "Midnight",
+                    "author": "",
+                    "published": "2024-03-01 00:00:00",
+                },
+            ],
+        )
+
+    def test_streaming_import(self):
+        Author.objects.create(name="Aidan Lister")
+
+        parser = CSVImportParser(BookImporterWithCache)
+        headers, rows = parser.parse(sample_csv_5_books)
+
+        sink = []
+        importer = ModelImporter(BookImporterWithCache)
+        importresult = importer.process(
+            headers,
+            rows,
+            commit=True,
+            progress_logger=lambda result_row: sink.append(result_row.linenumber),
+            resultset_cls=StreamingImportResultSet,
+            batch_size=2,
+        )
+
+        self.assertEqual(sink, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(importresult.get_results(), [])
+        self.assertEqual(importresult.get_counts(), (6, 0, 0, 1))
+        self.assertEqual(
+            importresult.get_errors(),
+            [(7, [("author", ["No Author matching 'Bill'."])])],
+        )
+        self.assertEqual(
+            repr(importresult), "ImportResultSet (7 rows, 1 errors, 0 warnings)"
+        )
+
+
+class FormClassBuilderTests(TestCase):
+    def test_form_classes_are_memoised(self):
+        builder = FormClassBuilder(BookImporter, ["id", "name", "author"])
+        ModelCreateForm = builder.build_create_form()
+        ModelUpdateForm = builder.build_update_form()
+        self.assertIsNot(ModelCreateForm, ModelUpdateForm)
+
+        # The same headers in a different order give the same classes
+        builder = FormClassBuilder(BookImporter, ["author", "name", "id"])
+        with mock.patch(
+            "djangomodelimport.formclassbuilder.modelform_factory"
+        ) as modelform_factory:
+            self.assertIs(builder.build_create_form(), ModelCreateForm)
+            self.assertIs(builder.build_update_form(), ModelUpdateForm)
+        modelform_factory.assert_not_called()
+
+        builder = FormClassBuilder(BookImporter, ["id", "name"])
+        self.assertIsNot(builder.build_update_form(), ModelUpdateForm)
+
+    def test_field_metadata_is_memoised(self):
+        class AuthorImporter(BookImporter):
+            pass
+
+        metadata = AuthorImporter.get_field_metadata()
+        with mock.patch.object(
+            AuthorImporter, "_build_field_metadata"
+        ) as build_field_metadata:
+            self.assertEqual(AuthorImporter.get_field_metadata(), metadata)
+        build_field_metadata.assert_not_called()
+
+        # Changing the fields invalidates the metadata
+        AuthorImporter.base_fields = dict(
+            AuthorImporter.base_fields, isbn=forms.CharField()
+        )
+        self.assertIn("isbn", AuthorImporter.get_field_metadata())
+
+
+class TransactionStrategyTests(TestCase):
+    def setUp(self):
+        Author.objects.create(name="Aidan Lister")
+        Author.objects.create(name="Bill")
+        parser = TablibCSVImportParser(BookImporterWithCache)
+        self.headers, self.rows = parser.parse(sample_csv_5_books)
+
+    def fail_to_save(self, name):
+        original_save = Book.save
+
+        def save(book, *args, **kwargs):
+            if book.name == name:
+                raise ValueError("Cannot save this one")
+            return original_save(book, *args, **kwargs)
+
+        return mock.patch.object(Book, "save", save)
+
+    def test_chunk_savepoint(self):
+        importer = ModelImporter(BookImporterWithCache)
+
+        # SAVEPOINT x2, SELECT authors, SAVEPOINT, INSERT x7, RELEASE SAVEPOINT x3
+        with self.assertNumQueries(14):
+            importresult = importer.process(
+                self.headers,
+                self.rows,
+                commit=True,
+                transaction_strategy=ChunkSavepointStrategy(),
+            )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(Book.objects.count(), 7)
+
+    def test_chunk_savepoint_bisects_failures(self):
+        importer = ModelImporter(BookImporterWithCache)
+        with self.fail_to_save("How to be great"):
+            importresult = importer.process(
+                self.headers,
+                self.rows,
+                commit=True,
+                transaction_strategy=ChunkSavepointStrategy(),
+            )
+
+        errors = importresult.get_errors()
+        self.assertEqual([linenumber for linenumber, _ in errors], [4])
+        self.assertEqual(importresult.get_counts(), (6, 0, 0, 1))
+        self.assertEqual(Book.objects.count(), 6)
+
+    def test_single_transaction_fails_fast(self):
+        importer = ModelImporter(BookImporterWithCache)
+        with self.fail_to_save("How to be great"), self.assertRaises(ValueError):
+            importer.process(
+                self.headers,
+                self.rows,
+                commit=True,
+                transaction_strategy=SingleTransactionStrategy(),
+            )
+        self.assertEqual(Book.objects.count(), 0)
+
+    def test_preview_without_savepoints(self):
+        importer = ModelImporter(BookImporterWithCache)
+
+        # SAVEPOINT x2, SELECT authors, ROLLBACK TO SAVEPOINT, RELEASE SAVEPOINT
+        with self.assertNumQueries(5):
+            importresult = importer.process(
+                self.headers,
+                self.rows,
+                commit=False,
+                transaction_strategy=NoSavepointStrategy(),
+            )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(Book.objects.count(), 0)
+
+
+class UpdateCacheTests(TestCase):
+    def test_only_rows_being_updated_are_loaded(self):
+        author = Author.objects.create(name="Aidan Lister")
+        books = [
+            Book.objects.create(name=f"Book {i}", author=author) for i in range(10)
+        ]
+
+        rows = [
+            {"id": str(books[0].id), "name": "Updated 0"},
+            {"id": str(books[5].id), "name": "Updated 5"},
+            {"id": "99999", "name": "Missing"},
+            {"id": "abc", "name": "Invalid"},
+        ]
+
+        for limit_to_queryset in (None, Book.objects.all()):
+            importer = ModelImporter(BookImporter)
+            importresult = importer.process(
+                ["id", "name"],
+                rows,
+                commit=True,
+                limit_to_queryset=limit_to_queryset,
+            )
+            self.assertEqual(
+                set(importer.update_cache), {str(books[0].id), str(books[5].id)}
+            )
+            self.assertEqual(importresult.updated, 2)
+            self.assertEqual(
+                [linenumber for linenumber, _ in importresult.get_errors()], [3, 4]
+            )
+
+        books[5].refresh_from_db()
+        self.assertEqual(books[5].name, "Updated 5")
+
+    def test_missing_rows_are_not_queried_individually(self):
+        importer = ModelImporter(BookImporter)
+        rows = [{"id": str(i), "name": "Missing"} for i in range(1000, 1010)]
+
+        # SAVEPOINT x2, SELECT books, ROLLBACK TO SAVEPOINT, RELEASE SAVEPOINT
+        with self.assertNumQueries(5):
+            importresult = importer.process(["id", "name"], rows, commit=False)
+        self.assertEqual(
+            importresult.get_errors()[0], (1, [("id", ["Book 1000 does not exist."])])
+        )
+
+    def test_padded_ids(self):
+        author = Author.objects.create(name="Aidan Lister")
+        book = Book.objects.create(name="Starburst", author=author)
+        other = Book.objects.create(name="Moonwalk", author=author)
+        rows = [
+            {"id": f" {book.id}", "name": "Padded"},
+            {"id": f"0{other.id}", "name": "Zero padded"},
+        ]
+
+        importresult = ModelImporter(BookImporter).process(
+            ["id", "name"], rows, commit=True
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(importresult.updated, 2)
+        book.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(book.name, "Padded")
+        self.assertEqual(other.name, "Zero padded")
+
+
+class PicklingExecutor(Executor):
+    """Runs work in this process (and so in the test transaction), but pickles
+    everything going to and from the worker as a process pool would."""
+
+    def submit(self, fn, *args, **kwargs):
+        fn, args, kwargs = pickle.loads(pickle.dumps((fn, args, kwargs)))
+        future = Future()
+        future.set_result(pickle.loads(pickle.dumps(fn(*args, **kwargs))))
+        return future
+
+
+class ParallelPreviewTests(TestCase):
+    def test_preview_parallel(self):
+        author = Author.objects.create(name="Aidan Lister")
+        b1 = Book.objects.create(name="Hello", author=author)
+
+        rows = [
+            {"id": "", "name": f"Book {i}", "author": "Aidan Lister"} for i in range(9)
+        ]
+        rows[4]["author"] = "Nobody"
+        rows[7]["id"] = str(b1.id)
+
+        sink = []
+        importer = ModelImporter(BookImporterWithCache)
+        importresult = importer.preview_parallel(
+            ["id", "name", "author"],
+            rows,
+            shard_size=2,
+            executor=PicklingExecutor(),
+            progress_logger=lambda result_row: sink.append(result_row.linenumber),
+            limit_to_queryset=Book.objects.all(),
+        )
+
+        self.assertEqual(sink, list(range(1, 10)))
+        self.assertEqual(
+            importresult.get_errors(),
+            [(5, [("author", ["No Author matching 'Nobody'."])])],
+        )
+        self.assertEqual(importresult.get_counts(), (7, 1, 0, 8))
+        self.assertEqual(importresult.get_results()[7].instance.pk, b1.pk)
+        self.assertEqual(Book.objects.count(), 1)
+
+    def test_duplicates_across_shards(self):
+        author = Author.objects.create(name="Aidan Lister")
+        book = Book.objects.create(name="Starburst", author=author)
+        edition = Edition.objects.create(book=book, number=1, isbn="111")
+        rows = [
+            {"id": "", "book": "Starburst", "number": "2", "isbn": "222"},
+            {"id": str(edition.pk), "book": "Starburst", "number": "1", "isbn": "111"},
+            {"id": "", "book": "Starburst", "number": "3", "isbn": "222"},
+            {"id": str(edition.pk), "book": "Starburst", "number": "1", "isbn": "111"},
+            {"id": "", "book": "Starburst", "number": "3", "isbn": "333"},
+        ]
+
+        importresult = ModelImporter(EditionImporter).preview_parallel(
+            ["id", "book", "number", "isbn"],
+            rows,
+            shard_size=2,
+            executor=PicklingExecutor(),
+        )
+
+        self.assertEqual(
+            importresult.get_errors(),
+            [
+                (3, [("isbn", ["Edition with this Isbn is already on line 1."])]),
+                (4, [("id", [f"Edition {edition.pk} is already updated on line 2."])]),
+            ],
+        )
+        self.assertEqual(importresult.get_counts(), (2, 1, 0, 4))
+
+
+class ExecutorPreviewTests(TransactionTestCase):
+    def test_process_pool(self):
+        author = Author.objects.create(name="Aidan Lister")
+        book = Book.objects.create(name="Hello", author=author)
+        rows = [
+            {"id": "", "name": f"Book {i}", "author": "Aidan Lister"} for i in range(6)
+        ]
+        rows[2]["author"] = "Nobody"
+        rows[4]["id"] = str(book.id)
+
+        importresult = ModelImporter(BookImporterWithCache).preview_parallel(
+            ["id", "name", "author"], rows, workers=2, shard_size=2
+        )
+
+        self.assertEqual(
+            importresult.get_errors(),
+            [(3, [("author", ["No Author matching 'Nobody'."])])],
+        )
+        self.assertEqual(importresult.get_counts(), (4, 1, 0, 5))
+        self.assertEqual(importresult.get_results()[4].instance.pk, book.pk)
+        self.assertEqual(Book.objects.count(), 1)
+
+    def test_thread_pool(self):
+        Author.objects.create(name="Aidan Lister")
+        rows = [
+            {"id": "", "name": f"Book {i}", "author": "Aidan Lister"} for i in range(8)
+        ]
+        rows[5]["author"] = "Nobody"
+
+        # Each thread keeps its own lookup caches
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            importresult = ModelImporter(BookImporterWithCache).preview_parallel(
+                ["id", "name", "author"], rows, shard_size=1, executor=executor
+            )
+
+        self.assertEqual(
+            importresult.get_errors(),
+            [(6, [("author", ["No Author matching 'Nobody'."])])],
+        )
+        self.assertEqual(importresult.get_counts(), (7, 0, 0, 8))
+
+
+class ImportProfilerTests(TestCase):
+    def test_profile(self):
+        Author.objects.create(name="Aidan Lister")
+
+        parser = TablibCSVImportParser(BookImporterWithCache)
+        headers, rows = parser.parse(sample_csv_5_books)
+
+        exported = []
+        importer = ModelImporter(BookImporterWithCache)
+        importresult = importer.process(
+            headers, rows, commit=True, profiler=ImportProfiler(exported.append)
+        )
+
+        profile = importresult.get_profile()
+        self.assertEqual(exported, [profile])
+        self.assertEqual(profile["importer"], "BookImporterWithCache")
+        self.assertEqual(
+            profile["caches"], {"author": {"hits": 7, "misses": 0, "prefetched": 2}}
+        )
+
+        phases = profile["phases"]
+        self.assertEqual(phases["prefetch"]["count"], 1)
+        self.assertEqual(phases["prefetch"]["queries"], 1)
+        self.assertEqual(phases["form_init"]["count"], 7)
+        self.assertEqual(phases["is_valid"]["count"], 7)
+        # A savepoint, insert and release for each of the 6 valid rows
+        self.assertEqual(phases["save"]["count"], 6)
+        self.assertEqual(phases["save"]["queries"], 18)
+        self.assertEqual(
+            profile["queries"], sum(phase["queries"] for phase in phases.values())
+        )
+
+    def test_flat_related_saves(self):
+        parser = TablibCSVImportParser(CompanyImporter)
+        headers, rows = parser.parse(sample_csv_6_companies)
+
+        importer = ModelImporter(CompanyImporter)
+        importresult = importer.process(
+            headers, rows, commit=True, profiler=ImportProfiler()
+        )
+
+        phases = importresult.get_profile()["phases"]
+        self.assertEqual(phases["flat_related_save"]["count"], 1)
+        self.assertEqual(phases["flat_related_save"]["queries"], 1)
+        # The contact's insert is counted against the innermost phase only
+        self.assertEqual(phases["save"]["queries"], 3)
+
+    def test_shared_caches(self):
+        Author.objects.create(name="Aidan Lister")
+        rows = [
+            {"id": "", "name": "Starburst", "author": "Aidan Lister"},
+            {"id": "", "name": "Moonwalk", "author": "Aidan Lister"},
+            {"id": "", "name": "Sunset", "author": "Aidan Lister"},
+        ]
+
+        # Only the lookups made by each import are recorded, not those of the imports before it
+        lookup_cache = SharedLookupCache()
+        importer = ModelImporter(BookImporterWithCache)
+        for prefetched in (1, 0):
+            importresult = importer.process(
+                ["id", "name", "author"],
+                rows,
+                lookup_cache=lookup_cache,
+                profiler=ImportProfiler(),
+            )
+            self.assertEqual(
+                importresult.get_profile()["caches"],
+                {"author": {"hits": 3, "misses": 0, "prefetched": prefetched}},
+            )
+
+    def test_not_profiled(self):
+        parser = TablibCSVImportParser(BookImporter)
+        headers, rows = parser.parse(sample_csv_1_books)
+
+        importresult = ModelImporter(BookImporter).process(headers, rows)
+
+        self.assertIsNone(importresult.get_profile())
+
+
+class BenchmarkTests(TestCase):
+    def test_run_benchmarks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report = run_benchmarks(directory, datasets=["reviews"], rows=50)
+
+        self.assertEqual(
+            [result["stage"] for result in report["results"]],
+            ["parse", "preview", "commit"],
+        )
+        commit = report["results"][2]
+        self.assertEqual(commit["created"] + commit["failed"], 50)
+        self.assertGreater(commit["created"], 0)
+        self.assertEqual(Review.objects.count(), commit["created"])
+        self.assertEqual(report["database"], "sqlite")
+        self.assertTrue(all(result["peak_rss_kb"] for result in report["results"]))
+
+    def test_peak_rss_of_each_stage(self):
+        large = measure("large", "test", 1, lambda: {"size": len(b"x" * 10**7)})
+        small = measure("small", "test", 1, lambda: {})
+
+        # Each stage's peak is its own, rather than the largest of the process so far
+        self.assertGreaterEqual(large["peak_rss_kb"] - small["peak_rss_kb"], 9000)
+        self.assertEqual(large["size"], 10**7)
+
+
+class SourceFieldSwitcherTests(TestCase):
+    def test_switchers_are_resolved_once_per_import(self):
+        author = Author.objects.create(name="Aidan Lister")
+        rows = [
+            {"id": "", "name": "Hello", "author_id": str(author.pk)},
+            {"id": "", "name": "Goodbye", "author_id": str(author.pk)},
+        ]
+
+        importer = ModelImporter(BookImporterWithSwitcher)
+        importresult = importer.process(["id", "name", "author_id"], rows, commit=True)
+
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(Book.objects.filter(author=author).count(), 2)
+
+        form_class = FormClassBuilder(
+            BookImporterWithSwitcher, ["id", "name", "author_id"]
+        ).build_create_form()
+        self.assertTrue(form_class.source_field_switchers_resolved)
+        self.assertIsInstance(form_class.base_fields["author"], CachedChoiceField)
+        self.assertEqual(form_class.base_fields["author"].to_field, "id")
+        # The importer class itself is never modified
+        self.assertIsInstance(
+            BookImporterWithSwitcher.base_fields["author"], SourceFieldSwitcher
+        )
+
+
+class ImportRowPlanTests(TestCase):
+    def test_plan(self):
+        headers = ["id", "author", "name", "metadata_isbn", "metadata_doi"]
+        form_class = FormClassBuilder(CitationImporter, headers).build_create_form()
+        caches = {}
+        plan = ImportRowPlan.for_form_class(form_class, caches, headers)
+
+        self.assertEqual(plan.cached_fields, ["author"])
+        self.assertEqual(plan.validation_exclusions, {"author"})
+        self.assertEqual(
+            plan.json_columns,
+            {"metadata": [("metadata_isbn", "isbn"), ("metadata_doi", "doi")]},
+        )
+        self.assertIs(plan.fields["author"].instancecache, caches["author"])
+        self.assertIsNot(plan.fields["author"], form_class.base_fields["author"])
+
+        row = {
+            "id": "",
+            "author": "Fred Johnston",
+            "name": "Starburst",
+            "metadata_isbn": "ISBN333",
+            "metadata_doi": "doi:111",
+        }
+        form1 = form_class(row, caches=caches, plan=plan)
+        form2 = form_class(row, caches=caches, plan=plan)
+
+        # Each form has its own copy of the plan's fields, bound to the same cache
+        self.assertIsNot(form1.fields["author"], plan.fields["author"])
+        self.assertIsNot(form1.fields["author"], form2.fields["author"])
+        self.assertIs(form2.fields["author"].instancecache, caches["author"])
+        self.assertTrue(form1.is_valid())
+        self.assertEqual(
+            form1.cleaned_data["metadata"], {"isbn": "ISBN333", "doi": "doi:111"}
+        )
+
+    def test_limit_choices_to(self):
+        class LimitedBookImporter(BookImporter):
+            author = forms.ModelChoiceField(
+                queryset=Author.objects.all(),
+                to_field_name="name",
+                limit_choices_to={"name__startswith": "A"},
+            )
+
+        Author.objects.create(name="Ann Limited")
+        headers = ["id", "name", "author"]
+        form_class = FormClassBuilder(LimitedBookImporter, headers).build_create_form()
+        plan = ImportRowPlan.for_form_class(form_class, {}, headers)
+        row = {"id": "", "name": "Starburst", "author": "Ann Limited"}
+        row_forms = [form_class(row, caches={}, plan=plan) for i in range(3)]
+
+        # The choices are only limited once for each form, rather than once more for every form before it
+        for form in row_forms:
+            query = str(form.fields["author"].queryset.query)
+            self.assertEqual(query.count("LIKE"), 1)
+
+        rows = [row] * 50 + [{"id": "", "name": "Moonwalk", "author": "Fred Johnston"}]
+        importresult = ModelImporter(LimitedBookImporter).process(
+            headers, rows, commit=True
+        )
+        self.assertEqual(importresult.get_counts(), (50, 0, 0, 1))
+
+    def test_flat_related_plan(self):
+        headers = ["id", "name", "contact_name", "email", "mobile", "address"]
+        form_class = FormClassBuilder(CompanyImporter, headers).build_create_form()
+        plan = ImportRowPlan.for_form_class(form_class, {}, headers)
+
+        self.assertEqual(
+            plan.flat_related,
+            {
+                "primary_contact": {
+                    "contact_name": "name",
+                    "email": "email",
+                    "mobile": "mobile",
+                    "address": "address",
+                }
+            },
+        )
+        self.assertEqual(plan.flat_related_mapping["email"], "primary_contact")
+
+
+class FlatRelatedWriteTests(TestCase):
+    headers = ["id", "name", "contact_name", "email", "mobile", "address"]
+
+    def get_rows(self, count):
+        return [
+            {
+                "id": "",
+                "name": f"Company {i}",
+                "contact_name": f"Contact {i}",
+                "email": f"contact{i}@example.com",
+                "mobile": "0400 000 000",
+                "address": "1 Example Street",
+            }
+            for i in range(count)
+        ]
+
+    def test_preview_does_not_write(self):
+        importer = ModelImporter(CompanyImporter)
+        with CaptureQueriesContext(connection) as queries:
+            importresult = importer.process(
+                self.headers, self.get_rows(3), commit=False
+            )
+
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertFalse(
+            [query for query in queries if query["sql"].startswith("INSERT")]
+        )
+
+    def test_invalid_rows_are_not_written(self):
+        rows = self.get_rows(2)
+        rows[0]["contact_name"] = ""
+        rows[1]["email"] = "not an email"
+
+        importer = ModelImporter(CompanyImporter)
+        importresult = importer.process(self.headers, rows, commit=True)
+
+        self.assertEqual(
+            importresult.get_errors(),
+            [
+                (1, [("primary_contact", ["contact_name: This field is required."])]),
+                (2, [("primary_contact", ["email: Enter a valid email address."])]),
+            ],
+        )
+        self.assertEqual(Contact.objects.count(), 0)
+
+    def test_bulk_writes(self):
+        contact = Contact.objects.create(name="Tapir", email="ziggur@t.com")
+        company1 = Company.objects.create(name="Okapi", primary_contact=contact)
+        company2 = Company.objects.create(name="Zebra", primary_contact=contact)
+
+        rows = self.get_rows(3) + [
+            {"id": str(company1.pk), "name": "Okapi", "email": "first@example.com"},
+            {"id": str(company2.pk), "name": "Zebra", "email": "second@example.com"},
+        ]
+
+        importer = ModelImporter(CompanyImporter)
+        with CaptureQueriesContext(connection) as queries:
+            importresult = importer.process(
+                ["id", "name", "contact_name", "email"], rows, commit=True, bulk=True
+            )
+
+        self.assertEqual(importresult.get_errors(), [])
+        contact_writes = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith(
+                ('INSERT INTO "testapp_contact"', 'UPDATE "testapp_contact"')
+            )
+        ]
+        self.assertEqual(len(contact_writes), 2)
+
+        for i in range(3):
+            company = Company.objects.get(name=f"Company {i}")
+            self.assertEqual(company.primary_contact.name, f"Contact {i}")
+        # Both rows updated the same contact, the last one wins
+        contact.refresh_from_db()
+        self.assertEqual(contact.email, "second@example.com")
+        self.assertEqual(Contact.objects.count(), 4)
+
+    def test_bulk_writes_merge_shared_instances(self):
+        contact = Contact.objects.create(
+            name="Tapir", email="ziggur@t.com", mobile="0400 000 000"
+        )
+        company1 = Company.objects.create(name="Okapi", primary_contact=contact)
+        company2 = Company.objects.create(name="Zebra", primary_contact=contact)
+        rows = [
+            {"id": str(company1.pk), "name": "Okapi", "email": "first@example.com"},
+            {"id": str(company2.pk), "name": "Zebra", "mobile": "0411 111 111"},
+        ]
+
+        importresult = ModelImporter(CompanyImporter).process(
+            ["id", "name", "email", "mobile"], rows, commit=True, bulk=True
+        )
+
+        # Each row's changes are kept, rather than the last row's instance overwriting the first's
+        self.assertEqual(importresult.get_errors(), [])
+        contact.refresh_from_db()
+        self.assertEqual(contact.email, "first@example.com")
+        self.assertEqual(contact.mobile, "0411 111 111")
+
+
+class ImportResultSetTests(TestCase):
+    def build_resultset(self, resultset_cls=ImportResultSet):
+        resultset = resultset_cls(headers=["id", "name"], header_form=None)
+        for i in range(1, 11):
+            errors = [("name", ["Bad name"])] if i % 3 == 0 else []
+            warnings = [("name", ["Odd name"])] if i % 2 else []
+            row = {"id": "", "name": str(i)}
+            resultset.append(i, row, errors, None, True, warnings)
+        return resultset
+
+    def test_counts_and_pages(self):
+        resultset = self.build_resultset()
+
+        self.assertEqual(
+            repr(resultset), "ImportResultSet (10 rows, 3 errors, 5 warnings)"
+        )
+        self.assertEqual([line for line, _ in resultset.get_errors()], [3, 6, 9])
+        self.assertEqual(
+            list(resultset.iter_errors(offset=1, limit=1)),
+            [(6, [("name", ["Bad name"])])],
+        )
+        self.assertEqual(
+            [line for line, _ in resultset.iter_warnings(offset=3)], [7, 9]
+        )
+        self.assertEqual(resultset.get_result(4).row, {"id": "", "name": "4"})
+        self.assertIsNone(resultset.get_result(11))
+
+    def test_drop_valid_row_data(self):
+        class CompactImportResultSet(ImportResultSet):
+            keep_valid_row_data = False
+
+        resultset = self.build_resultset(CompactImportResultSet)
+
+        self.assertIsNone(resultset.get_result(4).row)
+        self.assertEqual(resultset.get_result(3).row, {"id": "", "name": "3"})
+        self.assertFalse(hasattr(resultset.get_result(4), "__dict__"))
+        self.assertIn("__slots__", vars(ImportResultRow))
+
+
+class SQLiteImportResultSetTests(TestCase):
+    def test_import(self):
+        class SmallBatchImportResultSet(SQLiteImportResultSet):
+            flush_size = 3
+
+        Author.objects.create(name="Aidan Lister")
+
+        parser = TablibCSVImportParser(BookImporterWithCache)
+        headers, rows = parser.parse(sample_csv_5_books)
+
+        importer = ModelImporter(BookImporterWithCache)
+        with importer.process(
+            headers, rows, commit=True, resultset_cls=SmallBatchImportResultSet
+        ) as importresult:
+            self.assertEqual(importresult.results, [])
+            self.assertEqual(
+                repr(importresult), "ImportResultSet (7 rows, 1 errors, 0 warnings)"
+            )
+            self.assertEqual(
+                importresult.get_errors(),
+                [(7, [("author", ["No Author matching 'Bill'."])])],
+            )
+            self.assertEqual(
+                [result.linenumber for result in importresult.iter_results(2, 3)],
+                [3, 4, 5],
+            )
+            result = importresult.get_result(2)
+            self.assertEqual(result.instance.name, "How to be really awesome")
+            self.assertEqual(result.instance.author.name, "Aidan Lister")
+            self.assertIsNone(importresult.get_result(8))
+            path = importresult.path
+            self.assertTrue(os.path.exists(path))
+
+        self.assertFalse(os.path.exists(path))
+
+
+class AsyncImportTests(TransactionTestCase):
+    def test_aprocess(self):
+        Author.objects.create(name="Aidan Lister")
+
+        async def rows():
+            for i in range(5):
+                await asyncio.sleep(0)
+                yield {"id": "", "name": f"Book {i}", "author": "Aidan Lister"}
+
+        sink = []
+
+        async def progress_logger(result_row):
+            sink.append(result_row.linenumber)
+
+        importer = ModelImporter(BookImporterWithCache)
+        importresult = asyncio.run(
+            importer.aprocess(
+                ["id", "name", "author"],
+                rows(),
+                commit=True,
+                batch_size=2,
+                progress_logger=progress_logger,
+            )
+        )
+
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(sink, [1, 2, 3, 4, 5])
+        self.assertEqual(Book.objects.count(), 5)
+
+
+class CheckpointTests(TransactionTestCase):
+    def setUp(self):
+        Author.objects.create(name="Aidan Lister")
+        self.authors = Author.objects.count()
+        self.rows = [
+            {"id": "", "name": f"Book {i}", "author": "Aidan Lister"} for i in range(7)
+        ]
+        self.rows[3]["author"] = "Nobody"
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "checkpoints.jsonl")
+
+    def interrupted_rows(self, after):
+        for i, row in enumerate(self.rows):
+            if i == after:
+                raise KeyboardInterrupt
+            yield row
+
+    def process(self, rows):
+        return ModelImporter(BookImporterWithCache).process(
+            ["id", "name", "author"],
+            rows,
+            commit=True,
+            batch_size=2,
+            checkpoint_store=FileCheckpointStore(self.path),
+        )
+
+    def test_resume(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.process(self.interrupted_rows(after=5))
+        # The first two batches were committed, the third was rolled back
+        self.assertEqual(Book.objects.count(), 3)
+
+        importresult = self.process(self.rows)
+
+        self.assertEqual(importresult.get_counts(), (6, 0, 0, 1))
+        self.assertEqual(
+            [result.linenumber for result in importresult.get_results()], [5, 6, 7]
+        )
+        self.assertEqual(
+            sorted(Book.objects.values_list("name", flat=True)),
+            ["Book 0", "Book 1", "Book 2", "Book 4", "Book 5", "Book 6"],
+        )
+
+        # Running it again doesn't import anything more
+        self.assertEqual(self.process(self.rows).get_results(), [])
+        self.assertEqual(Book.objects.count(), 6)
+
+    def test_interrupted_after_commit(self):
+        calls = []
+
+        def commit(store, line):
+            calls.append(line)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+
+        with mock.patch.object(FileCheckpointStore, "commit", commit):
+            with self.assertRaises(KeyboardInterrupt):
+                self.process(self.rows)
+        # The second batch was committed to the database, but not checkpointed
+        self.assertEqual(Book.objects.count(), 3)
+
+        importresult = self.process(self.rows)
+
+        self.assertEqual(importresult.get_counts(), (6, 0, 0, 1))
+        self.assertEqual(Book.objects.count(), 6)
+
+
+class ColumnPreparseTests(TestCase):
+    headers = ["id", "book_author", "book", "author", "contact_name", "reviewed_at"]
+
+    def setUp(self):
+        author = Author.objects.create(name="Aidan Lister")
+        Book.objects.create(name="Starburst", author=author)
+
+    def make_row(self, reviewed_at):
+        return {
+            "id": "",
+            "book_author": "Aidan Lister",
+            "book": "Starburst",
+            "author": "Aidan Lister",
+            "contact_name": "Fred Johnston",
+            "reviewed_at": reviewed_at,
+        }
+
+    def test_parse_column(self):
+        field = DateTimeParserField()
+        self.assertEqual(
+            field.parse_column(
+                ["02/03/2020 10:30", " 2/3/2021 9:05", "", "2 March 2020"]
+            ),
+            [
+                datetime.datetime(2020, 3, 2, 10, 30),
+                datetime.datetime(2021, 3, 2, 9, 5),
+                "",
+                "2 March 2020",  # Doesn't match any format, left for to_python
+            ],
+        )
+        self.assertEqual(
+            DateTimeParserField(middle_endian=True).parse_column(["02/03/2020"]),
+            [datetime.datetime(2020, 2, 3)],
+        )
+        # Two digit years are left to dateutil
+        self.assertEqual(field.parse_column(["01/02/03"]), ["01/02/03"])
+
+    def test_matches_per_cell_parsing(self):
+        values = [
+            "02/03/2020 10:30",
+            "13/01/2020 00:00",
+            "01/13/2020 00:00",
+            "2020-01-02",
+            "01/02/03",
+            "not a date",
+            "",
+        ]
+        rows = [self.make_row(value) for value in values]
+        importer = ModelImporter(ReviewImporter)
+
+        preparsed = importer.process(self.headers, rows, commit=False)
+        unparsed = importer.process(self.headers, rows, commit=False, preparse=False)
+
+        self.assertEqual(
+            [result.get_errors() for result in preparsed.get_results()],
+            [result.get_errors() for result in unparsed.get_results()],
+        )
+
+        def reviewed_at(importresult):
+            return [
+                getattr(result.instance, "reviewed_at", None)
+                for result in importresult.get_results()
+            ]
+
+        self.assertEqual(reviewed_at(preparsed), reviewed_at(unparsed))
+        self.assertEqual(
+            preparsed.get_results()[2].instance.reviewed_at,
+            datetime.datetime(2020, 1, 13),
+        )
+        # The results keep the row as it was given
+        self.assertEqual(preparsed.get_results()[0].row, rows[0])
+        self.assertEqual(rows[0]["reviewed_at"], "02/03/2020 10:30")
+
+
+class DateTimeParserFieldCacheTests(TestCase):
+    def test_inferred_format(self):
+        field = DateTimeParserField()
+        with mock.patch("djangomodelimport.fields.parser.parse") as parse:
+            self.assertEqual(
+                field.to_python("02/03/2020"), datetime.datetime(2020, 3, 2)
+            )
+            self.assertEqual(
+                field.to_python("2020-03-04"), datetime.datetime(2020, 3, 4)
+            )
+            self.assertEqual(
+                field.to_python("05/03/2020"), datetime.datetime(2020, 3, 5)
+            )
+        # The format is inferred again from each value which doesn't match it
+        self.assertEqual(field.inferred_format, "%d/%m/%Y")
+        self.assertEqual(field.sampled, 3)
+        parse.assert_not_called()
+
+        field.sampled = field.sample_size
+        # Once the format is fixed, values which don't match it are parsed by dateutil
+        self.assertEqual(field.to_python("2020-03-06"), datetime.datetime(2020, 3, 6))
+        self.assertEqual(field.inferred_format, "%d/%m/%Y")
+
+    def test_cache(self):
+        field = DateTimeParserField()
+        field.cache_size = 2
+        field.to_python("01/02/03")
+        field.to_python("02/02/03")
+        with mock.patch("djangomodelimport.fields.parser.parse") as parse:
+            self.assertEqual(field.to_python("01/02/03"), datetime.datetime(2003, 2, 1))
+            parse.assert_not_called()
+        field.to_python("03/02/03")
+        self.assertEqual(list(field.parsed_values), ["01/02/03", "03/02/03"])
+
+        # Invalid values are remembered too
+        with self.assertRaises(forms.ValidationError):
+            field.to_python("not a date")
+        self.assertIsNone(field.parsed_values["not a date"])
+
+    def test_copies_infer_their_own_format(self):
+        field = DateTimeParserField()
+        field.to_python("02/03/2020")
+        copied = copy.deepcopy(field)
+        self.assertIsNone(copied.inferred_format)
+        self.assertEqual(list(copied.parsed_values), [])
+
+
+class UniquenessIndexTests(TestCase):
+    headers = ["id", "book", "number", "isbn"]
+
+    def setUp(self):
+        author = Author.objects.create(name="Aidan Lister")
+        starburst = Book.objects.create(name="Starburst", author=author)
+        Book.objects.create(name="Moonwalk", author=author)
+        self.edition = Edition.objects.create(book=starburst, number=1, isbn="111")
+
+    def test_duplicates(self):
+        pk = str(self.edition.pk)
+        rows = [
+            {"id": "", "book": "Starburst", "number": "2", "isbn": "222"},
+            {"id": "", "book": "Moonwalk", "number": "1", "isbn": "111"},
+            {"id": "", "book": "Moonwalk", "number": "1", "isbn": "222"},
+            {"id": "", "book": "Starburst", "number": "2", "isbn": "333"},
+            {"id": "", "book": "Starburst", "number": "1", "isbn": "444"},
+            {"id": pk, "book": "Starburst", "number": "1", "isbn": "111"},
+            {"id": pk, "book": "Starburst", "number": "3", "isbn": "555"},
+        ]
+        # Batched strategies check each unique field of a batch in one query, the others check each row as
+        # it's saved (as validate_unique would), so later rows can refer to it
+        for transaction_strategy, unique_queries in (
+            (ChunkSavepointStrategy(), 2),
+            (RowSavepointStrategy(), 12),
+        ):
+            with self.subTest(
+                transaction_strategy=transaction_strategy
+            ), transaction.atomic():
+                self.check_duplicates(rows, pk, transaction_strategy, unique_queries)
+                transaction.set_rollback(True)
+
+    def check_duplicates(self, rows, pk, transaction_strategy, unique_queries):
+        profiler = ImportProfiler()
+        importresult = ModelImporter(EditionImporter).process(
+            self.headers,
+            rows,
+            commit=True,
+            profiler=profiler,
+            transaction_strategy=transaction_strategy,
+        )
+
+        errors = dict(importresult.get_errors())
+        self.assertEqual(list(errors), [2, 3, 4, 5, 7])
+        self.assertEqual(
+            errors[2], [("isbn", ["Edition with this Isbn already exists."])]
+        )
+        self.assertEqual(
+            errors[3], [("isbn", ["Edition with this Isbn is already on line 1."])]
+        )
+        self.assertEqual(
+            errors[4],
+            [("__all__", ["Edition with this Book and Number is already on line 1."])],
+        )
+        self.assertEqual(
+            errors[5],
+            [("__all__", ["Edition with this Book and Number already exists."])],
+        )
+        self.assertEqual(
+            errors[7], [("id", [f"Edition {pk} is already updated on line 6."])]
+        )
+        self.assertEqual(Edition.objects.count(), 2)
+
+        phases = profiler.get_stats()["phases"]
+        self.assertEqual(phases["unique_check"]["queries"], unique_queries)
+        self.assertEqual(phases["is_valid"]["queries"], 0)
+
+    def test_across_batches(self):
+        rows = [
+            {"id": "", "book": "Starburst", "number": str(i), "isbn": str(i % 3)}
+            for i in range(2, 8)
+        ]
+        importresult = ModelImporter(EditionImporter).process(
+            self.headers, rows, commit=False, batch_size=2
+        )
+        self.assertEqual(
+            [linenumber for linenumber, errors in importresult.get_errors()], [4, 5, 6]
+        )
+
+    def test_before_django_41(self):
+        def get_unique_checks(edition, exclude=None):
+            # Before Django 4.1, there's no include_meta_constraints argument
+            return get_unique_checks_41(edition, exclude, include_meta_constraints=True)
+
+        get_unique_checks_41 = Edition._get_unique_checks
+        with mock.patch("django.VERSION", (4, 0, 0, "final", 0)), mock.patch.object(
+            Edition, "_get_unique_checks", get_unique_checks
+        ):
+            index = UniquenessIndex.for_model(Edition)
+        self.assertEqual(
+            index.unique_checks, UniquenessIndex.for_model(Edition).unique_checks
+        )
+
+    def test_failed_saves_are_forgotten(self):
+        pk = str(self.edition.pk)
+        rows = [
+            {"id": "", "book": "Moonwalk", "number": "9", "isbn": "222"},
+            {"id": "", "book": "Moonwalk", "number": "2", "isbn": "222"},
+            {"id": pk, "book": "Starburst", "number": "9", "isbn": "111"},
+            {"id": pk, "book": "Starburst", "number": "3", "isbn": "111"},
+            {"id": "", "book": "Moonwalk", "number": "4", "isbn": "222"},
+        ]
+        save = Edition.save
+
+        def failing_save(edition, *args, **kwargs):
+            if edition.number == 9:
+                raise IntegrityError("Number 9 is not allowed.")
+            return save(edition, *args, **kwargs)
+
+        # Lines 2 and 4 only duplicate lines which fail to save, whether they're in the same batch or not
+        for batch_size in (500, 1):
+            with self.subTest(batch_size=batch_size), transaction.atomic():
+                with mock.patch.object(Edition, "save", failing_save):
+                    importresult = ModelImporter(EditionImporter).process(
+                        self.headers, rows, commit=True, batch_size=batch_size
+                    )
+
+                errors = dict(importresult.get_errors())
+                self.assertEqual(list(errors), [1, 3, 5])
+                self.assertEqual(
+                    errors[5],
+                    [("isbn", ["Edition with this Isbn is already on line 2."])],
+                )
+                self.assertEqual(importresult.get_counts(), (1, 1, 0, 3))
+                self.edition.refresh_from_db()
+                self.assertEqual(self.edition.number, 3)
+                transaction.set_rollback(True)
+
+
+class JSONFieldColumnTests(TestCase):
+    def test_columns_resolved_from_headers(self):
+        headers = ["id", "name", "author", "metadata_isbn", "metadata_doi"]
+        form_class = FormClassBuilder(CitationImporter, headers).build_update_form()
+        widget = form_class.base_fields["metadata"].widget
+
+        self.assertEqual(
+            widget.columns, [("metadata_isbn", "isbn"), ("metadata_doi", "doi")]
+        )
+        # The importer's own field is left alone
+        self.assertIsNone(CitationImporter.base_fields["metadata"].widget.columns)
+
+        data = {"name": "Starburst", "metadata_doi": "doi:111", "metadata_x": "y"}
+        self.assertEqual(
+            widget.value_from_datadict(data, {}, "metadata"), {"doi": "doi:111"}
+        )
+        self.assertFalse(widget.value_omitted_from_data(data, {}, "metadata"))
+        self.assertTrue(widget.value_omitted_from_data({"name": "x"}, {}, "metadata"))
+
+    def test_skipped_without_headers(self):
+        builder = FormClassBuilder(CitationImporter, ["id", "name", "author"])
+        self.assertNotIn("metadata", builder.build_update_form().base_fields)
+
+        author = Author.objects.create(name="Jane Citer")
+        citation = Citation.objects.create(
+            name="Starburst", author=author, metadata={"isbn": "ISBN333"}
+        )
+        importresult = ModelImporter(CitationImporter).process(
+            ["id", "name", "author"],
+            [{"id": str(citation.pk), "name": "Moonwalk", "author": "Jane Citer"}],
+            commit=True,
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        citation.refresh_from_db()
+        self.assertEqual(citation.name, "Moonwalk")
+        self.assertEqual(citation.metadata, {"isbn": "ISBN333"})
+
+
+class SharedLookupCacheTests(TestCase):
+    def setUp(self):
+        Author.objects.create(name="Aidan Lister")
+        Author.objects.create(name="Bill")
+        self.headers = ["id", "name", "author"]
+        self.rows = [
+            {"id": "", "name": "Starburst", "author": "Aidan Lister"},
+            {"id": "", "name": "Moonwalk", "author": "Bill"},
+            {"id": "", "name": "Sunset", "author": "Nobody"},
+        ]
+
+    def test_commit_after_preview(self):
+        lookup_cache = SharedLookupCache()
+        importer = ModelImporter(BookImporterWithCache)
+        importer.process(
+            self.headers, self.rows, commit=False, lookup_cache=lookup_cache
+        )
+
+        profiler = ImportProfiler()
+        importresult = importer.process(
+            self.headers,
+            self.rows,
+            commit=True,
+            lookup_cache=lookup_cache,
+            profiler=profiler,
+        )
+        self.assertEqual(importresult.get_counts(), (2, 0, 0, 1))
+        # Only the value which wasn't found is looked up again
+        self.assertEqual(profiler.get_stats()["phases"]["prefetch"]["queries"], 1)
+
+    def test_values_created_after_preview(self):
+        lookup_cache = SharedLookupCache()
+        importer = ModelImporter(BookImporterWithCache)
+        preview = importer.process(
+            self.headers, self.rows, commit=False, lookup_cache=lookup_cache
+        )
+        self.assertEqual([linenumber for linenumber, _ in preview.get_errors()], [3])
+
+        Author.objects.create(name="Nobody")
+        importresult = importer.process(
+            self.headers, self.rows, commit=True, lookup_cache=lookup_cache
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(importresult.get_counts(), (3, 0, 0, 0))
+
+    def test_shared_by_importers(self):
+        lookup_cache = SharedLookupCache()
+        ModelImporter(BookImporterWithCache).process(
+            self.headers, self.rows, lookup_cache=lookup_cache
+        )
+        ModelImporter(CitationImporter).process(
+            self.headers, self.rows, lookup_cache=lookup_cache
+        )
+        self.assertEqual(len(lookup_cache.loaders), 1)
+
+        # A different query gets its own loader
+        field = CachedChoiceField(
+            queryset=Author.objects.filter(name__startswith="B"), to_field="name"
+        )
+        self.assertIsNot(
+            lookup_cache.get_loader(field), list(lookup_cache.loaders.values())[0]
+        )
+
+    def test_eviction_and_invalidation(self):
+        lookup_cache = SharedLookupCache(max_entries=2)
+        authors = lookup_cache.get_loader(
+            CachedChoiceField(queryset=Author.objects.all(), to_field="name")
+        )
+        authors.prefetch(["Aidan Lister", "Bill"])
+        books = lookup_cache.get_loader(
+            CachedChoiceField(queryset=Book.objects.all(), to_field="name")
+        )
+        self.assertEqual(list(lookup_cache.loaders.values()), [authors, books])
+
+        books.prefetch(["Starburst"])
+        lookup_cache.trim()
+        self.assertEqual(list(lookup_cache.loaders.values()), [books])
+
+        lookup_cache.invalidate(Book)
+        self.assertEqual(lookup_cache.loaders, {})
+
+
+class BoundedInstanceLoaderTests(TestCase):
+    def setUp(self):
+        self.authors = [Author.objects.create(name=f"Author {i}") for i in range(4)]
+
+    def test_max_entries(self):
+        loader = CachedInstanceLoader(Author.objects.all(), "name", max_entries=2)
+        loader["Author 0"]
+        loader["Author 1"]
+        loader["Author 0"]  # Now the most recently used
+        loader["Author 2"]
+        self.assertEqual(list(loader), ["Author 0", "Author 2"])
+
+        # Errors are kept separately
+        with self.assertRaises(Author.DoesNotExist):
+            loader["Nobody"]
+        loader["Author 3"]
+        self.assertEqual(list(loader), ["Author 2", "Nobody", "Author 3"])
+
+    def test_max_negative_entries(self):
+        loader = CachedInstanceLoader(
+            Author.objects.all(), "name", max_negative_entries=2
+        )
+        for value in ["Nobody 1", "Author 0", "Nobody 2", "Nobody 3"]:
+            loader.prefetch([value])
+        self.assertEqual(list(loader), ["Author 0", "Nobody 2", "Nobody 3"])
+
+    def test_batch_larger_than_max_entries(self):
+        authors = [f"Author {i}" for i in range(4)] + ["Nobody 1", "Nobody 2"]
+
+        class BookImporterWithBoundedCache(BookImporterWithCache):
+            author = CachedChoiceField(
+                queryset=Author.objects.all(),
+                to_field="name",
+                max_entries=2,
+                max_negative_entries=1,
+            )
+
+        # The values prefetched for the batch aren't evicted until its rows are processed
+        caches = {}
+        profiler = ImportProfiler()
+        importresult = ModelImporter(BookImporterWithBoundedCache).process(
+            ["id", "name", "author"],
+            [{"id": "", "name": "Book", "author": author} for author in authors],
+            commit=True,
+            caches=caches,
+            profiler=profiler,
+        )
+        self.assertEqual(importresult.get_counts(), (4, 0, 0, 2))
+        self.assertEqual(profiler.get_stats()["phases"]["prefetch"]["queries"], 1)
+        self.assertEqual(profiler.get_stats()["caches"]["author"]["misses"], 0)
+        # Then the cache is trimmed back to its limits
+        self.assertEqual(len(caches["author"]), 3)
+        self.assertEqual(len(caches["author"].negative_keys), 1)
+
+    def test_create_missing_without_negative_entries(self):
+        class BookImporterCreatingAuthors(BookImporterWithCache):
+            author = CachedChoiceField(
+                queryset=Author.objects.all(),
+                to_field="name",
+                max_negative_entries=0,
+                create_missing=True,
+            )
+
+        importresult = ModelImporter(BookImporterCreatingAuthors).process(
+            ["id", "name", "author"],
+            [
+                {"id": "", "name": "Starburst", "author": "Nobody 1"},
+                {"id": "", "name": "Moonwalk", "author": "Nobody 2"},
+            ],
+            commit=True,
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(
+            importresult.get_created_lookups(), {"author": ["Nobody 1", "Nobody 2"]}
+        )
+
+        field = importresult.header_form.base_fields["author"]
+        loader = field.get_loader()
+        self.assertEqual(
+            loader.create_missing(["Nobody 3"], field.build_missing), ["Nobody 3"]
+        )
+        self.assertEqual(Author.objects.filter(name__startswith="Nobody").count(), 3)
+
+    def test_pk_only(self):
+        loader = CachedInstanceLoader(Author.objects.all(), "name", pk_only=True)
+        with self.assertNumQueries(1):
+            loader.prefetch(["Author 0", "Author 1"])
+        self.assertEqual(dict.__getitem__(loader, "Author 0"), self.authors[0].pk)
+
+        with self.assertNumQueries(0):
+            author = loader["Author 0"]
+            self.assertEqual(author, self.authors[0])
+            self.assertEqual(author.get_deferred_fields(), {"name"})
+        with self.assertNumQueries(1):
+            self.assertEqual(loader["Author 2"].pk, self.authors[2].pk)
+
+    def test_preloaded_pk_only(self):
+        loader = PreloadedInstanceLoader(Author.objects.all(), "name", pk_only=True)
+        loader.load()
+        with self.assertNumQueries(0):
+            loader.prefetch(["Author 0"])
+            self.assertEqual(loader["Author 0"].pk, self.authors[0].pk)
+            self.assertEqual(loader["Author 1"].pk, self.authors[1].pk)
+
+    def test_field_options(self):
+        Book.objects.create(name="Starburst", author=self.authors[0])
+        field = CachedChoiceField(
+            queryset=Author.objects.all(), to_field="name", pk_only=True
+        )
+        loader = field.get_loader()
+        importresult = ModelImporter(BookImporterWithCache).process(
+            ["id", "name", "author"],
+            [{"id": "", "name": "Moonwalk", "author": "Author 1"}],
+            commit=True,
+            caches={"author": loader},
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(dict(loader), {"Author 1": self.authors[1].pk})
+        self.assertEqual(Book.objects.get(name="Moonwalk").author, self.authors[1])
+
+
+class CreateMissingTests(TestCase):
+    headers = ["id", "name", "author"]
+
+    def setUp(self):
+        Author.objects.create(name="Aidan Lister")
+        self.authors = Author.objects.count()
+        self.rows = [
+            {"id": "", "name": "Starburst", "author": "Aidan Lister"},
+            {"id": "", "name": "Moonwalk", "author": "Somebody"},
+            {"id": "", "name": "Sunset", "author": "Nobody"},
+            {"id": "", "name": "Sunrise", "author": "Somebody"},
+        ]
+
+    def test_preview(self):
+        preview = ModelImporter(BookImporterCreatingAuthors).process(
+            self.headers, self.rows, commit=False
+        )
+        self.assertEqual(preview.get_errors(), [])
+        self.assertEqual(
+            preview.get_created_lookups(), {"author": ["Nobody", "Somebody"]}
+        )
+        self.assertEqual(preview.get_results()[1].instance.author.name, "Somebody")
+        self.assertEqual(Author.objects.count(), self.authors)
+
+    def test_commit(self):
+        importresult = ModelImporter(BookImporterCreatingAuthors).process(
+            self.headers, self.rows, commit=True, batch_size=2
+        )
+        self.assertEqual(importresult.get_counts(), (4, 0, 0, 0))
+        self.assertEqual(
+            importresult.get_created_lookups(), {"author": ["Somebody", "Nobody"]}
+        )
+        self.assertEqual(Author.objects.count(), self.authors + 2)
+        somebody = Author.objects.get(name="Somebody")
+        self.assertEqual(
+            set(somebody.book_set.values_list("name", flat=True)),
+            {"Moonwalk", "Sunrise"},
+        )
+
+    def test_preview_then_commit(self):
+        lookup_cache = SharedLookupCache()
+        importer = ModelImporter(BookImporterCreatingAuthors)
+        preview = importer.process(
+            self.headers, self.rows, commit=False, lookup_cache=lookup_cache
+        )
+        self.assertEqual(
+            preview.get_created_lookups(), {"author": ["Nobody", "Somebody"]}
+        )
+
+        importresult = importer.process(
+            self.headers, self.rows, commit=True, lookup_cache=lookup_cache
+        )
+        self.assertEqual(importresult.get_errors(), [])
+        self.assertEqual(
+            importresult.get_created_lookups(), {"author": ["Nobody", "Somebody"]}
+        )
+        self.assertEqual(Author.objects.count(), self.authors + 2)
+        self.assertEqual(Book.objects.filter(author__name="Nobody").count(), 1)
+
+    def test_create_unsaved(self):
+        field = BookImporterCreatingAuthors.base_fields["author"]
+        loader = field.get_loader()
+        self.assertEqual(
+            loader.create_missing(["Nobody"], field.build_missing, commit=False),
+            ["Nobody"],
+        )
+        self.assertIsNone(loader["Nobody"].pk)
+
+        # The unsaved instance is created when the values are committed
+        self.assertEqual(
+            loader.create_missing(["Nobody"], field.build_missing), ["Nobody"]
+        )
+        self.assertEqual(loader["Nobody"], Author.objects.get(name="Nobody"))
+
+        loader.create_missing(["Somebody"], field.build_missing, commit=False)
+        loader.discard_unsaved()
+        self.assertNotIn("Somebody", loader)
+        self.assertIn("Nobody", loader)
+
+    def test_build_missing(self):
+        field = CachedChoiceField(
+            queryset=Book.objects.all(),
+            to_field=("author__name", "name"),
+            create_missing=lambda value: Book(
+                name=value[1], author=Author.objects.get(name=value[0])
+            ),
+        )
+        loader = field.get_loader()
+        created = loader.create_missing(
+            [("Aidan Lister", "Starburst")], field.build_missing
+        )
+        self.assertEqual(created, [("Aidan Lister", "Starburst")])
+        self.assertEqual(Book.objects.get().name, "Starburst")
+
+        with self.assertRaises(ImproperlyConfigured):
+            CachedChoiceField(
+                queryset=Book.objects.all(),
+                to_field=("author__name", "name"),
+                create_missing=True,
+            )
+
+    def test_invalid_instances_fail_their_rows(self):
+        class EditionImporterCreatingBooks(EditionImporter):
+            book = CachedChoiceField(
+                queryset=Book.objects.all(), to_field="name", create_missing=True
+            )
+
+        # A new Book needs an author, so its rows fail rather than the insert
+        importresult = ModelImporter(EditionImporterCreatingBooks).process(
+            ["id", "book", "number", "isbn"],
+            [
+                {"id": "", "book": "Starburst", "number": "1", "isbn": "1"},
+                {"id": "", "book": "Starburst", "number": "2", "isbn": "2"},
+            ],
+            commit=True,
+        )
+        errors = importresult.get_errors()
+        self.assertEqual([linenumber for linenumber, _ in errors], [1, 2])
+        self.assertIn("Couldn't create Book 'Starburst'", str(errors[0][1]))
+        self.assertEqual(importresult.get_created_lookups(), {})
+        self.assertFalse(Book.objects.exists())
+
+    def test_filtered_queryset(self):
+        # The created values wouldn't match the filter, so they must be built by a callable
+        with self.assertRaises(ImproperlyConfigured):
+            CachedChoiceField(
+                queryset=Author.objects.filter(name__startswith="A"),
+                to_field="name",
+                create_missing=True,
+            )
+        CachedChoiceField(
+            queryset=Author.objects.filter(name__startswith="A"),
+            to_field="name",
+            create_missing=lambda value: Author(name=value),
+        )
+
+
+class SelfReferenceTests(TestCase):
+    headers = ["id", "ref", "parent"]
+    rows = [
+        {"id": "", "ref": "A", "parent": ""},
+        {"id": "", "ref": "B", "parent": "A"},
+        {"id": "", "ref": "C", "parent": "B"},
+    ]
+
+    def test_rows_refer_to_earlier_rows(self):
+        for importer_class in (SiteImporter, SiteImporterWithCache):
+            with self.subTest(importer_class=importer_class), transaction.atomic():
+                importresult = ModelImporter(importer_class).process(
+                    self.headers, self.rows, commit=True
+                )
+
+                self.assertEqual(importresult.get_errors(), [])
+                self.assertEqual(Site.objects.get(ref="C").parent.parent.ref, "A")
+                transaction.set_rollback(True)